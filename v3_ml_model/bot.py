@@ -1,21 +1,69 @@
 # v3_ml_model/bot.py
+import asyncio
 import io
 import logging
-import numpy as np
-from datetime import datetime, timedelta
+import os
 from telegram import Update, KeyboardButton, ReplyKeyboardMarkup
-from telegram.ext import Application, CommandHandler, ContextTypes
+from telegram.error import BadRequest
+from telegram.ext import Application, CommandHandler, ContextTypes, SimpleUpdateProcessor
 from model import predict_trend, get_advice
-from plotter import plot_trend
-from data_loader import get_all_currencies, get_rates_range
-from feature_engineer import compute_rsi
+from plotter import chart_key, parse_date_range, plot_trend
+from data_loader import get_all_currencies
+from cross_rates import BASE_CURRENCY, is_valid_symbol, parse_symbol, symbol_name
+from market import get_indicators, rank_market, rsi_status, volatility_level
+import profiling
+import storage
+from jobs import HIGH, LOW, JobScheduler
+from profiling import profiled
 
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
 )
 logger = logging.getLogger(__name__)
 
-TOKEN = "token"  # ← замените при необходимости
+TOKEN = os.getenv("BOT_TOKEN", "token")  # ← замените при необходимости
+
+# === Режим работы (выбирается через окружение) ===
+BOT_MODE = os.getenv("BOT_MODE", "polling")  # polling | webhook
+BOT_API_URL = os.getenv("BOT_API_URL")  # напр. http://127.0.0.1:8081/bot — локальная заглушка
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # публичный адрес; по умолчанию http://listen:port/path
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+MAX_CONCURRENT_UPDATES = int(os.getenv("BOT_CONCURRENCY", "8"))
+MAX_PENDING_UPDATES = int(os.getenv("BOT_MAX_PENDING", str(4 * MAX_CONCURRENT_UPDATES)))
+# Telegram user id администраторов через запятую — им доступна /profile
+BOT_ADMINS = {int(uid) for uid in os.getenv("BOT_ADMINS", "").split(",") if uid.strip()}
+
+# === Тяжёлые /predict (графики за долгий период) — в очередь задач ===
+HEAVY_DAYS = int(os.getenv("BOT_HEAVY_DAYS", "90"))  # длиннее — в очередь, с ответом «⏳ …»
+LOW_PRIORITY_DAYS = int(os.getenv("BOT_LOW_PRIORITY_DAYS", "730"))  # длиннее — низкий приоритет
+JOB_WORKERS = int(os.getenv("BOT_JOB_WORKERS", "2"))
+JOB_PER_USER = int(os.getenv("BOT_JOB_PER_USER", "1"))  # одновременно выполняемых задач пользователя
+JOB_MAX_PENDING = int(os.getenv("BOT_JOB_MAX_PENDING", "3"))  # принятых задач пользователя
+JOBS = JobScheduler(workers=JOB_WORKERS, per_user=JOB_PER_USER, max_pending=JOB_MAX_PENDING)
+
+
+class BoundedUpdateQueue(asyncio.Queue):
+    """Очередь апдейтов с ограничением числа необработанных апдейтов (backpressure).
+
+    put() ждёт свободного слота, пока в очереди и в обработке уже `limit` апдейтов;
+    слот освобождается в task_done(), который Application вызывает после обработки.
+    В режиме webhook это задерживает ответ Telegram, в режиме polling — следующий getUpdates.
+    """
+
+    def __init__(self, limit: int):
+        super().__init__()
+        self._slots = asyncio.Semaphore(limit)
+
+    async def put(self, item) -> None:
+        await self._slots.acquire()
+        await super().put(item)
+
+    def task_done(self) -> None:
+        super().task_done()
+        self._slots.release()
 
 
 def get_kb():
@@ -36,6 +84,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         "Доступные команды:\n"
         "• /predict USD 7 — прогноз + график\n"
         "• /advice USD — аналитический совет\n"
+        "• /market — обзор всего рынка\n"
         "• /how — как считается?\n"
         "• /clear — очистить сообщения",
         reply_markup=get_kb(),
@@ -49,8 +98,11 @@ async def help_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         "   Примеры:\n"
         "   /predict USD        → 7 дней + ML + график\n"
         "   /predict GBP 10     → график за 10 дней\n"
-        "   /predict CHF 01.12–18.12 → период\n\n"
+        "   /predict CHF 01.12–18.12 → период\n"
+        "   /predict USD 2020–2024   → несколько лет\n"
+        "   /predict EUR/USD 30      → кросс-курс любой пары\n\n"
         "🔹 /advice USD — совет по валюте\n"
+        "🔹 /market [1|3|7] — обзор всех валют: рост, падение, волатильность\n"
         "🔹 /how — как работает расчёт?\n"
         "🔹 /clear — очистить последние сообщения бота\n\n"
         "ℹ️ Все данные — от ЦБ РФ. Прогнозы — аналитические."
@@ -106,8 +158,9 @@ async def clear_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     )
 
 
+@profiled()
 async def list_currencies(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    currencies = get_all_currencies()
+    currencies = await profiling.to_thread(get_all_currencies)
     items = [f"`{code}` — {name}" for code, name in sorted(currencies.items())]
     mid = (len(items) + 1) // 2
     col1 = items[:mid]
@@ -122,6 +175,7 @@ async def list_currencies(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     await update.message.reply_text(text, parse_mode="Markdown", reply_markup=get_kb())
 
 
+@profiled()
 async def advice_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     args = context.args
     if not args:
@@ -129,14 +183,14 @@ async def advice_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
         return
 
     curr = args[0].upper()
-    currencies = get_all_currencies()
+    currencies = await profiling.to_thread(get_all_currencies)
     if curr not in currencies:
         await update.message.reply_text(
             f"❌ Валюта `{curr}` не найдена. См. /list.", parse_mode="Markdown"
         )
         return
 
-    advice = get_advice(curr)
+    advice = await profiling.to_thread(get_advice, curr)
     if not advice:
         await update.message.reply_text(f"⚠️ Не удалось сформировать совет для {curr}.")
         return
@@ -149,12 +203,54 @@ async def advice_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
     await update.message.reply_text(text, parse_mode="Markdown")
 
 
+@profiled()
+async def market_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    period = context.args[0] if context.args else "7"
+    if period not in ("1", "3", "7"):
+        await update.message.reply_text("📌 Период: /market 1, /market 3 или /market 7")
+        return
+
+    ranking = await profiling.to_thread(rank_market, f"d{period}")
+    if not ranking:
+        await update.message.reply_text("⚠️ Не удалось получить курсы для обзора рынка.")
+        return
+
+    def fmt(rows, unit="%", sign=True):
+        return "\n".join(
+            f"  `{code}` {value:+.2f}{unit}" if sign else f"  `{code}` {value:.2f}{unit}"
+            for code, value in rows
+        ) or "  —"
+
+    text = (
+        f"🌍 *Обзор рынка* (на {ranking['date'].strftime('%d.%m')}, Δ за {period} дн.)\n\n"
+        f"📈 Рост:\n{fmt(ranking['gainers'])}\n\n"
+        f"📉 Падение:\n{fmt(ranking['losers'])}\n\n"
+        f"🌪 Волатильность (7 дн.):\n{fmt(ranking['volatile'], sign=False)}"
+    )
+    await update.message.reply_text(text, parse_mode="Markdown", reply_markup=get_kb())
+
+
+def job_priority(date_arg: str) -> int | None:
+    """Класс приоритета для /predict с периодом date_arg; None — лёгкий запрос, выполняется сразу."""
+    if date_arg.isdigit():
+        days = int(date_arg)
+    else:
+        period = parse_date_range(date_arg)
+        if period is None:
+            return None
+        days = (period[1] - period[0]).days
+    if days <= HEAVY_DAYS:
+        return None
+    return LOW if days > LOW_PRIORITY_DAYS else HIGH
+
+
+@profiled()
 async def predict(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     args = context.args
     if not args:
         await update.message.reply_text(
             "📌 Укажите валюту и (опционально) период:\n"
-            "/predict USD 7\n/predict EUR 01.12–18.12",
+            "/predict USD 7\n/predict EUR 01.12–18.12\n/predict EUR/USD 30",
             reply_markup=get_kb(),
         )
         return
@@ -162,8 +258,8 @@ async def predict(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     curr = args[0].upper()
     date_arg = args[1] if len(args) > 1 else "7"
 
-    currencies = get_all_currencies()
-    if curr not in currencies:
+    currencies = await profiling.to_thread(get_all_currencies)
+    if not is_valid_symbol(curr, currencies):
         await update.message.reply_text(
             f"❌ Валюта `{curr}` не найдена.\nСм. /list — полный список.",
             parse_mode="Markdown",
@@ -171,50 +267,72 @@ async def predict(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         )
         return
 
-    # === 📊 Расширенная аналитика ===
+    priority = job_priority(date_arg)
+    if priority is None:
+        await send_prediction(update.message, curr, date_arg)
+        return
+
+    # Долгий период: сразу отвечаем «⏳ …» и освобождаем слот обработки апдейтов —
+    # результат придёт правкой этого сообщения, когда задачу возьмёт исполнитель
+    ahead = JOBS.ahead(priority)
+    status = await update.message.reply_text(
+        f"⏳ Готовлю прогноз и график {curr} ({date_arg})…"
+        + (f"\nЗадач в очереди перед вашей: {ahead}" if ahead else "")
+    )
+    user_id = update.effective_user.id if update.effective_user else update.effective_chat.id
+    job = await JOBS.submit(
+        user_id, priority, f"predict {curr} {date_arg}", predict_job, update.message, status, curr, date_arg
+    )
+    if job is None and JOBS.closed:
+        await status.edit_text("🔄 Бот перезапускается — повторите запрос через минуту.")
+    elif job is None:
+        await status.edit_text(
+            f"✋ Ваших запросов уже в работе: {JOBS.pending(user_id)}. Дождитесь результата и повторите."
+        )
+
+
+@profiled("predict_job")
+async def predict_job(message, status, curr: str, date_arg: str) -> None:
+    """Тяжёлый /predict из очереди JOBS: первый текстовый ответ заменяет сообщение «⏳ …»."""
+    placeholder = [status]
+
+    async def reply(text: str, **kwargs):
+        if placeholder:
+            return await placeholder.pop().edit_text(text, **kwargs)
+        return await message.reply_text(text, **kwargs)
+
     try:
-        end = datetime.now()
-        start = end - timedelta(days=20)
-        full_data = get_rates_range(start, end, curr)
-        if len(full_data) >= 3:
-            rates = [r for _, r in full_data]
-            dates = [d for d, _ in full_data]
-
-            d1 = (rates[-1] - rates[-2]) / rates[-2] * 100 if len(rates) >= 2 else 0.0
-            d3 = (rates[-1] - rates[-3]) / rates[-3] * 100 if len(rates) >= 3 else 0.0
-            d7 = (rates[-1] - rates[-7]) / rates[-7] * 100 if len(rates) >= 7 else 0.0
-
-            changes_7 = [
-                (rates[i] - rates[i - 1]) / rates[i - 1]
-                for i in range(max(1, len(rates) - 7), len(rates))
-            ]
-            vol_7 = np.std(changes_7) * 100 if len(changes_7) > 1 else 0.0
-            vol_level = (
-                "низкая" if vol_7 < 0.5 else "средняя" if vol_7 < 1.2 else "высокая"
-            )
+        await send_prediction(message, curr, date_arg, reply)
+    except Exception:
+        await reply(f"⚠️ Не удалось подготовить прогноз для {curr}. Попробуйте позже.")
+        raise
 
-            rsi = compute_rsi(rates[-6:], period=5)
-            rsi_status = (
-                "перекупленность"
-                if rsi > 70
-                else "перепроданность" if rsi < 30 else "нейтрально"
-            )
 
+async def send_prediction(message, curr: str, date_arg: str, reply=None) -> None:
+    """Аналитика, ML-прогноз и график в ответ на message; reply — отправка текстовых ответов."""
+    reply = reply or message.reply_text
+
+    # === 📊 Расширенная аналитика (общая таблица индикаторов) ===
+    try:
+        ind = await profiling.to_thread(get_indicators, curr)
+        if ind:
+            base, quote = parse_symbol(curr)
+            unit = "₽" if quote == BASE_CURRENCY else quote
             stats_text = (
-                f"📊 *{curr}/RUB* (на {dates[-1].strftime('%d.%m')}):\n"
-                f"• Курс: {rates[-1]:.4f} ₽\n"
-                f"• Δ (1 дн.): {d1:+.2f}%\n"
-                f"• Δ (3 дн.): {d3:+.2f}%\n"
-                f"• Δ (7 дн.): {d7:+.2f}%\n"
-                f"• Волатильность (7 дн.): {vol_7:.2f}% ({vol_level})\n"
-                f"• RSI(5): {rsi:.1f} ({rsi_status})"
+                f"📊 *{base}/{quote}* (на {ind['date'].strftime('%d.%m')}):\n"
+                f"• Курс: {ind['rate']:.4f} {unit}\n"
+                f"• Δ (1 дн.): {ind['d1']:+.2f}%\n"
+                f"• Δ (3 дн.): {ind['d3']:+.2f}%\n"
+                f"• Δ (7 дн.): {ind['d7']:+.2f}%\n"
+                f"• Волатильность (7 дн.): {ind['vol_7']:.2f}% ({volatility_level(ind['vol_7'])})\n"
+                f"• RSI(5): {ind['rsi']:.1f} ({rsi_status(ind['rsi'])})"
             )
-            await update.message.reply_text(stats_text, parse_mode="Markdown")
+            await reply(stats_text, parse_mode="Markdown")
     except Exception as e:
         logger.warning(f"Не удалось собрать статистику для {curr}: {e}")
 
     # === ✅ ML-прогноз (единая модель) ===
-    res = predict_trend(curr)
+    res = await profiling.to_thread(predict_trend, curr)
     if res:
         if res["trend"] == "неопределённо":
             arrow = "❓"
@@ -226,39 +344,109 @@ async def predict(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             f"→ Уверенность: {res['confidence']}%\n"
             f"→ Основание: {res['reason']}"
         )
-        await update.message.reply_text(text, parse_mode="Markdown")
+        await reply(text, parse_mode="Markdown")
     else:
-        await update.message.reply_text(f"⚠️ Не удалось получить ML-прогноз для {curr}.")
+        await reply(f"⚠️ Не удалось получить ML-прогноз для {curr}.")
 
     # === 📈 График ===
-    img_bytes = plot_trend(curr, date_arg)
+    caption = f"📊 {symbol_name(curr)}"
+    if date_arg.isdigit():
+        caption += f" за {date_arg} дн."
+    else:
+        caption += f" ({date_arg})"
+
+    # Уже отправленный кем-то (любой репликой) график — повторно по file_id, без отрисовки
+    key = await profiling.to_thread(chart_key, curr, date_arg)
+    file_id = key and await profiling.to_thread(storage.get_chart, key)
+    if file_id:
+        try:
+            await message.reply_photo(file_id, caption=caption)
+            return
+        except BadRequest as e:
+            logger.warning(f"file_id графика {key} недействителен: {e}")
+            await profiling.to_thread(storage.drop_chart, key)
+
+    img_bytes = await profiling.to_thread(plot_trend, curr, date_arg)
     if img_bytes:
-        caption = f"📊 {curr}/RUB"
-        if date_arg.isdigit():
-            caption += f" за {date_arg} дн."
-        else:
-            caption += f" ({date_arg})"
-        await update.message.reply_photo(io.BytesIO(img_bytes), caption=caption)
+        msg = await message.reply_photo(io.BytesIO(img_bytes), caption=caption)
+        if key and msg.photo:
+            await profiling.to_thread(storage.put_chart, key, msg.photo[-1].file_id)
     else:
-        await update.message.reply_text(
+        await reply(
             "⚠️ Не удалось построить график. Проверьте дату."
         )
 
 
+async def profile_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """/profile N — профилировать следующие N команд; /profile off — отменить (только BOT_ADMINS)."""
+    user = update.effective_user
+    if user is None or user.id not in BOT_ADMINS:
+        return
+    args = context.args
+    if args and args[0].lower() == "off":
+        profiling.arm(0)
+    elif args and args[0].isdigit():
+        profiling.arm(int(args[0]))
+
+    state = profiling.status()
+    reports = sorted(profiling.PROFILE_DIR.glob("*.txt"))[-5:] if profiling.PROFILE_DIR.exists() else []
+    lines = [
+        f"🔬 Профилирование: следующих команд — {state['armed']}",
+        f"PROFILE={int(state['always'])}, PROFILE_SAMPLE={state['sample'] or '—'}",
+        f"Отчёты: {profiling.PROFILE_DIR}/",
+    ]
+    lines += [f"• {path.name}" for path in reports]
+    await update.message.reply_text("\n".join(lines))
+
+
 # === Запуск ===
-def main():
-    if not TOKEN or len(TOKEN) < 10:
-        raise ValueError("❗ Укажите корректный токен")
-    app = Application.builder().token(TOKEN).build()
+def build_app() -> Application:
+    builder = (
+        Application.builder()
+        .token(TOKEN)
+        .update_queue(BoundedUpdateQueue(MAX_PENDING_UPDATES))
+        .concurrent_updates(SimpleUpdateProcessor(MAX_CONCURRENT_UPDATES))
+    )
+    if BOT_API_URL:
+        builder = builder.base_url(BOT_API_URL)
+    # Дообработать принятые тяжёлые задачи при остановке (как и уже принятые апдейты)
+    builder = builder.post_stop(lambda app: JOBS.drain())
+    app = builder.build()
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("help", help_cmd))
     app.add_handler(CommandHandler("how", how_cmd))
     app.add_handler(CommandHandler("clear", clear_cmd))
     app.add_handler(CommandHandler("list", list_currencies))
     app.add_handler(CommandHandler("advice", advice_cmd))
+    app.add_handler(CommandHandler("market", market_cmd))
     app.add_handler(CommandHandler("predict", predict))
-    logger.info("✅ v3.0 запущен: аналитика + ML + советы + очистка")
-    app.run_polling(allowed_updates=Update.ALL_TYPES)
+    app.add_handler(CommandHandler("profile", profile_cmd))
+    return app
+
+
+def main():
+    if not TOKEN or len(TOKEN) < 10:
+        raise ValueError("❗ Укажите корректный токен")
+    app = build_app()
+    logger.info(
+        f"✅ v3.0 запущен ({BOT_MODE}): аналитика + ML + советы + очистка; "
+        f"параллельно {MAX_CONCURRENT_UPDATES}, в очереди до {MAX_PENDING_UPDATES}; "
+        f"тяжёлых задач: {JOB_WORKERS} исполнителя, до {JOB_PER_USER} на пользователя"
+    )
+    # При SIGINT/SIGTERM run_* сначала закрывает приём апдейтов,
+    # затем Application.stop() дожидается обработки уже принятых (graceful drain).
+    if BOT_MODE == "webhook":
+        app.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET,
+            max_connections=MAX_CONCURRENT_UPDATES,
+            allowed_updates=Update.ALL_TYPES,
+        )
+    else:
+        app.run_polling(allowed_updates=Update.ALL_TYPES)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,189 @@
+# v3_ml_model/cbr_import.py
+"""Офлайн-импорт сохранённых XML ЦБ РФ (XML_daily.asp, XML_dynamic.asp) в общую БД курсов.
+
+    python cbr_import.py archive.tar.gz          # tar / tar.gz / tar.bz2 / tar.xz
+    python cbr_import.py saved_xml/ extra.xml    # каталоги (рекурсивно) и отдельные файлы
+
+Документы разбираются потоково (iterparse), курсы нормируются на номинал и пишутся
+одной транзакцией — новый узел получает всю историю за секунды и без сети.
+"""
+import argparse
+import logging
+import os
+import tarfile
+import time
+import xml.etree.ElementTree as ET
+from datetime import datetime
+from pathlib import Path
+
+import storage
+from data_loader import DEFAULT_CURRENCY_IDS, fill_forward
+
+logging.basicConfig(
+    format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# Дольше документ ЦБ не действует (новогодние каникулы: курс от 28.12 — до 11.01);
+# больший разрыв между документами — пропуск в архиве, его не заполняем
+MAX_FILL_DAYS = 15
+
+
+def _parse_date(text: str):
+    return datetime.strptime(text, "%d.%m.%Y").date()
+
+
+def _rate(elem) -> float:
+    return float(elem.findtext("Value").replace(",", ".")) / int(elem.findtext("Nominal"))
+
+
+def parse_document(stream) -> dict | None:
+    """Один документ ЦБ → словарь; None, если это не курсы.
+
+    daily:   {"kind": "daily", "day": date, "rates": [(код, курс)], "catalog": [(код, название, ID)]}
+    dynamic: {"kind": "dynamic", "id": Valute ID, "records": [(дата, курс)], "end": date | None}
+    """
+    events = ET.iterparse(stream, events=("start", "end"))
+    _, root = next(events)
+    if root.tag != "ValCurs":
+        return None
+    # Атрибуты — сразу: root.clear() ниже стирает и их
+    attrs = dict(root.attrib)
+
+    if "ID" in attrs:
+        records = []
+        for event, elem in events:
+            if event == "end" and elem.tag == "Record":
+                records.append((_parse_date(elem.get("Date")), _rate(elem)))
+                root.clear()  # разобранные записи не копятся в дереве
+        end = attrs.get("DateRange2")
+        return {"kind": "dynamic", "id": attrs["ID"], "records": records, "end": end and _parse_date(end)}
+
+    rates, catalog = [], []
+    for event, elem in events:
+        if event == "end" and elem.tag == "Valute":
+            code = elem.findtext("CharCode")
+            rates.append((code, _rate(elem)))
+            catalog.append((code, elem.findtext("Name"), elem.get("ID")))
+            root.clear()
+    return {"kind": "daily", "day": _parse_date(attrs["Date"]), "rates": rates, "catalog": catalog}
+
+
+def _open_path(path: str):
+    if tarfile.is_tarfile(path):
+        # Потоковый режим: члены архива читаются по порядку, без распаковки на диск
+        with tarfile.open(path, "r|*") as tar:
+            for member in tar:
+                if member.isfile():
+                    yield f"{path}:{member.name}", tar.extractfile(member)
+    else:
+        with open(path, "rb") as f:
+            yield path, f
+
+
+def iter_sources(paths: list[str]):
+    """(имя, бинарный поток) для каждого файла: каталоги — рекурсивно, tar — по членам."""
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames.sort()
+                for name in sorted(filenames):
+                    yield from _open_path(os.path.join(dirpath, name))
+        else:
+            yield from _open_path(path)
+
+
+def _dynamic_rows(doc: dict, code: str) -> list[tuple[str, int, float]]:
+    if not doc["records"]:
+        return []
+    start = min(day for day, _ in doc["records"])
+    end = doc["end"] or max(day for day, _ in doc["records"])
+    # Будни без записи — последним установленным курсом, как при загрузке динамики из сети
+    filled = fill_forward(doc["records"], start, end)
+    return [(code, day.toordinal(), rate) for day, rate in filled.items() if day.weekday() < 5]
+
+
+def _daily_batches(daily: dict):
+    """Ежедневные документы по порядку дат; каждый покрывает и будни до следующего документа.
+
+    ЦБ датирует документ днём, с которого курс действует: курсы на понедельник и после
+    праздников приходят документом субботы или последнего рабочего дня. Все покрытые
+    будни — полные дни, как при загрузке бота по XML_daily.
+    """
+    if not daily:
+        return
+    days = sorted(daily)
+    # Какой документ действует в каждый день — fill_forward по (дата документа, номер)
+    effective = fill_forward([(day, i) for i, day in enumerate(days)], days[0], days[-1])
+    covered = {}
+    for day, i in effective.items():
+        if day == days[i] or (day.weekday() < 5 and (day - days[i]).days <= MAX_FILL_DAYS):
+            covered.setdefault(i, []).append(day.toordinal())
+    for i, day in enumerate(days):
+        ordinals = covered.get(i, [])
+        yield [(code, o, rate) for o in ordinals for code, rate in daily[day]], ordinals
+
+
+def _batches(paths: list[str], stats: dict):
+    """Пакеты (строки курсов, полные дни) по одному на документ — для storage.put_rates_bulk."""
+    ids = {cbr_id: code for code, cbr_id in {**DEFAULT_CURRENCY_IDS, **storage.get_currency_ids()}.items()}
+    unresolved = []
+    daily = {}  # дата → [(код, курс)]: пишутся в конце, когда известны даты всех документов
+
+    for name, stream in iter_sources(paths):
+        try:
+            doc = parse_document(stream)
+        except (ET.ParseError, KeyError, AttributeError, TypeError, ValueError) as e:
+            logger.warning(f"Пропуск {name}: {e}")
+            doc = None
+        if doc is None:
+            stats["skipped"] += 1
+            continue
+        stats["files"] += 1
+
+        if doc["kind"] == "daily":
+            ids.update((cbr_id, code) for code, _, cbr_id in doc["catalog"] if cbr_id)
+            if stats["newest"] is None or doc["day"] > stats["newest"]:
+                stats["newest"], stats["catalog"] = doc["day"], doc["catalog"]
+            daily[doc["day"]] = doc["rates"]
+        elif doc["id"] in ids:
+            yield _dynamic_rows(doc, ids[doc["id"]]), []
+        else:
+            # Код валюты может найтись в ежедневном файле дальше по архиву
+            unresolved.append(doc)
+
+    for doc in unresolved:
+        if doc["id"] in ids:
+            yield _dynamic_rows(doc, ids[doc["id"]]), []
+        else:
+            logger.warning(f"Динамика {doc['id']}: неизвестный код валюты, пропуск")
+
+    # После динамики: курсы XML_daily за тот же день важнее
+    yield from _daily_batches(daily)
+
+
+def import_archives(paths: list[str]) -> dict:
+    stats = {"files": 0, "skipped": 0, "newest": None, "catalog": None}
+    t0 = time.perf_counter()
+    stats["rows"], stats["days"] = storage.put_rates_bulk(_batches(paths, stats))
+    stats["seconds"] = time.perf_counter() - t0
+
+    # Справочник — только если его ещё нет; помечен устаревшим, бот обновит его из ЦБ
+    if stats["catalog"] and storage.get_catalog() is None:
+        storage.put_catalog(stats["catalog"], updated=0)
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Импорт сохранённых XML ЦБ РФ в БД курсов")
+    parser.add_argument("paths", nargs="+", help="каталоги, XML-файлы или tar-архивы")
+    parser.add_argument("--db", default=str(storage.DB_PATH), help="путь к БД (по умолчанию BOT_DB)")
+    args = parser.parse_args()
+    storage.DB_PATH = Path(args.db)
+
+    stats = import_archives(args.paths)
+    rate = stats["rows"] / stats["seconds"] if stats["seconds"] else 0
+    logger.info(
+        f"✅ {stats['files']} документов ({stats['skipped']} пропущено): {stats['rows']} курсов, "
+        f"{stats['days']} полных дней за {stats['seconds']:.1f} с ({rate:,.0f} строк/с) → {storage.DB_PATH}"
+    )
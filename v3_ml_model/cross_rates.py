@@ -0,0 +1,88 @@
+# v3_ml_model/cross_rates.py
+import threading
+from collections import OrderedDict
+import numpy as np
+from datetime import datetime
+from data_loader import get_rates_range
+from series import RateSeries
+
+# ЦБ публикует курсы только к рублю; остальные пары — отношения двух столбцов
+BASE_CURRENCY = "RUB"
+
+# Сколько рассчитанных рядов пар держим в памяти (ключ — пара и период)
+PAIR_CACHE_SIZE = 256
+
+_PAIR_CACHE: OrderedDict = OrderedDict()
+_PAIR_LOCK = threading.Lock()
+
+
+def parse_symbol(symbol: str) -> tuple[str, str]:
+    """'EUR/USD' → ('EUR', 'USD'); 'USD' → ('USD', 'RUB')."""
+    base, _, quote = symbol.strip().upper().partition("/")
+    return base, quote or BASE_CURRENCY
+
+
+def symbol_name(symbol: str) -> str:
+    return "/".join(parse_symbol(symbol))
+
+
+def is_valid_symbol(symbol: str, currencies: dict) -> bool:
+    base, quote = parse_symbol(symbol)
+    known = set(currencies) | {BASE_CURRENCY}
+    return base != quote and base in known and quote in known
+
+
+def cross_rates(base_rates: np.ndarray, quote_rates: np.ndarray) -> np.ndarray:
+    """Кросс-курс BASE/QUOTE из курсов к рублю: (RUB за 1 BASE) / (RUB за 1 QUOTE).
+
+    Работает и со столбцами, и с целыми матрицами дата × валюта.
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.asarray(base_rates, dtype=np.float64) / np.asarray(quote_rates, dtype=np.float64)
+
+
+def _pair_range(
+    start_date: datetime, end_date: datetime, base: str, quote: str
+) -> RateSeries:
+    # Рубль — единичный «курс»: ряд пары совпадает по датам с рядом другой валюты
+    if base == BASE_CURRENCY:
+        quote_leg = get_rates_range(start_date, end_date, quote)
+        days, ratio = quote_leg.days, cross_rates(1.0, quote_leg.rates)
+    elif quote == BASE_CURRENCY:
+        base_leg = get_rates_range(start_date, end_date, base)
+        days, ratio = base_leg.days, base_leg.rates
+    else:
+        base_leg, quote_leg = get_rates_range(start_date, end_date, base).align(
+            get_rates_range(start_date, end_date, quote)
+        )
+        days, ratio = base_leg.days, cross_rates(base_leg.rates, quote_leg.rates)
+    ok = np.isfinite(ratio)
+    return RateSeries(days, ratio) if ok.all() else RateSeries(days[ok], ratio[ok])
+
+
+def get_series(
+    start_date: datetime, end_date: datetime, symbol: str
+) -> RateSeries:
+    """Ряд курса для валюты ('USD' → USD/RUB) или пары ('EUR/USD').
+
+    Курсы к рублю берутся как есть; ряды пар считаются из уже загруженных
+    курсов обеих валют и кэшируются по (пара, период) при первом запросе.
+    """
+    base, quote = parse_symbol(symbol)
+    if quote == BASE_CURRENCY:
+        return get_rates_range(start_date, end_date, base)
+
+    key = (base, quote, start_date.date(), end_date.date())
+    with _PAIR_LOCK:
+        if key in _PAIR_CACHE:
+            _PAIR_CACHE.move_to_end(key)
+            return _PAIR_CACHE[key]
+
+    series = _pair_range(start_date, end_date, base, quote)
+    if not series:
+        return series
+    with _PAIR_LOCK:
+        _PAIR_CACHE[key] = series
+        if len(_PAIR_CACHE) > PAIR_CACHE_SIZE:
+            _PAIR_CACHE.popitem(last=False)
+    return series
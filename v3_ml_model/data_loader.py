@@ -1,84 +1,88 @@
-import os
-import json
 import logging
+import numpy as np
 import requests
 import xml.etree.ElementTree as ET
-from datetime import datetime, timedelta
-from pathlib import Path
+from datetime import date, datetime, timedelta
+import storage
+from series import RateSeries
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-CACHE_DIR = Path("cache")
-CACHE_DIR.mkdir(exist_ok=True)
-
-# Кэш списка валют (загружается один раз)
-_ALL_CURRENCIES = None
+CBR_DAILY_URL = "https://cbr.ru/scripts/XML_daily.asp"
+CBR_DYNAMIC_URL = "https://cbr.ru/scripts/XML_dynamic.asp"
+
+# Сколько недостающих дней оправдывает один запрос динамики вместо посуточных
+DYNAMIC_MIN_DAYS = 10
+
+# Справочник валют в общей БД перечитывается из ЦБ раз в сутки
+CATALOG_TTL = 24 * 3600
+
+FALLBACK_CURRENCIES = {
+    "USD": "Доллар США",
+    "EUR": "Евро",
+    "CNY": "Юань",
+    "GBP": "Фунт стерлингов",
+    "JPY": "Японская иена",
+    "CHF": "Швейцарский франк",
+}
+# Внутренние коды ЦБ (Valute ID) — нужны для XML_dynamic.asp, пока справочник не загружен
+DEFAULT_CURRENCY_IDS = {
+    "USD": "R01235",
+    "EUR": "R01239",
+    "CNY": "R01375",
+    "GBP": "R01035",
+    "JPY": "R01820",
+    "CHF": "R01775",
+}
 
 
 def get_all_currencies(refresh: bool = False) -> dict[str, str]:
-    """Возвращает {CharCode: Name} для всех валют из XML ЦБ РФ."""
-    global _ALL_CURRENCIES
-    if _ALL_CURRENCIES and not refresh:
-        return _ALL_CURRENCIES
+    """Возвращает {CharCode: Name} для всех валют из XML ЦБ РФ (через общий справочник в БД)."""
+    if not refresh:
+        catalog = storage.get_catalog(max_age=CATALOG_TTL)
+        if catalog:
+            return catalog
 
     try:
-        url = "https://cbr.ru/scripts/XML_daily.asp"
-        resp = requests.get(url, timeout=10)
+        resp = requests.get(CBR_DAILY_URL, timeout=10)
         resp.raise_for_status()
         root = ET.fromstring(resp.content)
 
-        _ALL_CURRENCIES = {
-            valute.find("CharCode").text: valute.find("Name").text
+        rows = [
+            (valute.find("CharCode").text, valute.find("Name").text, valute.get("ID"))
             for valute in root.findall("Valute")
-        }
-        logger.info(f"✅ Загружено {len(_ALL_CURRENCIES)} валют из ЦБ РФ")
-        return _ALL_CURRENCIES
+        ]
+        storage.put_catalog(rows)
+        logger.info(f"✅ Загружено {len(rows)} валют из ЦБ РФ")
+        return {code: name for code, name, _ in rows}
     except Exception as e:
         logger.error(f"❌ Не удалось загрузить список валют: {e}")
-        # fallback
-        return {
-            "USD": "Доллар США",
-            "EUR": "Евро",
-            "CNY": "Юань",
-            "GBP": "Фунт стерлингов",
-            "JPY": "Японская иена",
-            "CHF": "Швейцарский франк",
-        }
-
-
-def _get_cache_path(date: datetime) -> Path:
-    return CACHE_DIR / f"{date.strftime('%Y-%m-%d')}.json"
-
-
-def _load_from_cache(date: datetime) -> dict | None:
-    path = _get_cache_path(date)
-    if path.exists():
-        try:
-            return json.loads(path.read_text(encoding="utf-8"))
-        except Exception as e:
-            logger.warning(f"Кэш повреждён {path}: {e}")
-    return None
-
-
-def _save_to_cache(date: datetime, data: dict) -> None:
-    path = _get_cache_path(date)
-    path.parent.mkdir(parents=True, exist_ok=True)  
-    path.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+        # Устаревший справочник лучше урезанного fallback
+        return storage.get_catalog() or dict(FALLBACK_CURRENCIES)
 
 
-def get_exchange_rate(date: datetime, currency: str) -> float | None:
-    cached = _load_from_cache(date)
-    if cached and currency in cached:
-        return cached[currency]
+def _fetch_daily(date: datetime) -> dict | None:
+    """Все курсы на дату из XML_daily.asp {CharCode: курс за 1 единицу}; пишет полный день в кэш.
 
+    На дату, для которой курс ещё не установлен, ЦБ отвечает последним документом —
+    такой ответ не записывается и не возвращается.
+    """
     date_str = date.strftime("%d/%m/%Y")
-    url = f"https://cbr.ru/scripts/XML_daily.asp?date_req={date_str}"
+    url = f"{CBR_DAILY_URL}?date_req={date_str}"
     try:
         resp = requests.get(url, timeout=10)
         resp.raise_for_status()
         root = ET.fromstring(resp.content)
 
+        # Документ датирован днём, с которого действует (на понедельник — субботний);
+        # позже сегодняшнего дня и даты документа курс ещё может измениться
+        day = date.toordinal()
+        doc_day = datetime.strptime(root.get("Date"), "%d.%m.%Y").toordinal()
+        if not doc_day <= day <= max(datetime.now().toordinal(), doc_day):
+            logger.info(f"Курс на {date_str} ещё не установлен (последний документ — {root.get('Date')})")
+            return None
+
         rates = {}
         for valute in root.findall("Valute"):
             char_code = valute.find("CharCode").text
@@ -87,22 +91,155 @@ def get_exchange_rate(date: datetime, currency: str) -> float | None:
             value = float(value_str)
             rates[char_code] = value / nominal
 
-        _save_to_cache(date, rates)
-        return rates.get(currency)
+        storage.put_rates([(code, day, rate) for code, rate in rates.items()], complete_days=[day])
+        return rates
     except Exception as e:
-        logger.error(f"Ошибка при получении курса {currency} на {date_str}: {e}")
+        logger.error(f"Ошибка при получении курсов на {date_str}: {e}")
         return None
 
 
-def get_rates_range(
-    start_date: datetime, end_date: datetime, currency: str
-) -> list[tuple[datetime, float]]:
-    dates = []
+def get_exchange_rate(date: datetime, currency: str) -> float | None:
+    day = date.toordinal()
+    cached = storage.get_rate(currency, day)
+    if cached is not None:
+        return cached
+    # День загружен целиком, а валюты в нём нет — курса не было (валюта новая или выведена)
+    if storage.complete_days(day, day):
+        return None
+
+    rates = _fetch_daily(date)
+    return rates.get(currency) if rates else None
+
+
+def get_rate_matrix(
+    start_date: datetime, end_date: datetime
+) -> tuple[list[datetime], list[str], np.ndarray]:
+    """Матрица курсов дата × валюта по будням периода (NaN — валюты в этот день не было)."""
+    first, last = start_date.toordinal(), end_date.toordinal()
+    complete = storage.complete_days(first, last)
+    weekdays = {}
     current = start_date
     while current <= end_date:
-        if current.weekday() < 5: 
-            rate = get_exchange_rate(current, currency)
-            if rate is not None:
-                dates.append((current, rate))
+        if current.weekday() < 5:
+            weekdays[current.toordinal()] = current
+            if current.toordinal() not in complete:
+                _fetch_daily(current)
         current += timedelta(days=1)
-    return dates
+
+    # Один запрос на весь период вместо чтения по дням
+    rows = [row for row in storage.get_complete_rows(first, last) if row[0] in weekdays]
+    ordinals = sorted({day for day, _, _ in rows})
+    codes = sorted({code for _, code, _ in rows})
+    matrix = np.full((len(ordinals), len(codes)), np.nan)
+    day_idx = {day: i for i, day in enumerate(ordinals)}
+    code_idx = {code: j for j, code in enumerate(codes)}
+    for day, code, rate in rows:
+        matrix[day_idx[day], code_idx[code]] = rate
+    return [weekdays[day] for day in ordinals], codes, matrix
+
+
+def _fetch_dynamic(
+    start_date: datetime, end_date: datetime, currency: str
+) -> dict:
+    """Курсы одной валюты за период одним запросом XML_dynamic.asp → {date: курс}.
+
+    ЦБ отдаёт записи только на даты установки курса, поэтому будни без записи
+    (напр. понедельник) заполняются последним известным курсом — как в XML_daily.
+    """
+    val_id = storage.get_currency_id(currency)
+    if not val_id:
+        get_all_currencies()
+        val_id = storage.get_currency_id(currency) or DEFAULT_CURRENCY_IDS.get(currency)
+    if not val_id:
+        return {}
+
+    params = {
+        "date_req1": (start_date - timedelta(days=10)).strftime("%d/%m/%Y"),
+        "date_req2": end_date.strftime("%d/%m/%Y"),
+        "VAL_NM_RQ": val_id,
+    }
+    try:
+        resp = requests.get(CBR_DYNAMIC_URL, params=params, timeout=30)
+        resp.raise_for_status()
+        root = ET.fromstring(resp.content)
+
+        records = []
+        for record in root.findall("Record"):
+            day = datetime.strptime(record.get("Date"), "%d.%m.%Y").date()
+            nominal = int(record.find("Nominal").text)
+            value = float(record.find("Value").text.replace(",", "."))
+            records.append((day, value / nominal))
+    except Exception as e:
+        logger.error(f"Ошибка при получении динамики {currency}: {e}")
+        return {}
+    return fill_forward(records, start_date.date(), end_date.date())
+
+
+def fill_forward(records: list[tuple[date, float]], start: date, end: date) -> dict[date, float]:
+    """Записи динамики (дата установки, курс) → курс на каждый день [start, end].
+
+    Дни без записи получают последний установленный курс; будущие даты не заполняются —
+    курс на них ещё не установлен.
+    """
+    records = sorted(records)
+    rates = {}
+    idx, rate = 0, None
+    current = start
+    while current <= min(end, datetime.now().date()):
+        while idx < len(records) and records[idx][0] <= current:
+            rate = records[idx][1]
+            idx += 1
+        if rate is not None:
+            rates[current] = rate
+        current += timedelta(days=1)
+    return rates
+
+
+def get_rates_range(
+    start_date: datetime, end_date: datetime, currency: str
+) -> RateSeries:
+    """Курсы валюты по будням периода. Уже загруженные — одним индексным чтением по (валюта, день)."""
+    first, last = start_date.toordinal(), end_date.toordinal()
+    cached = RateSeries.from_rows(storage.get_rates(currency, first, last))
+    # ordinal 1 (01.01.0001) — понедельник; субботние курсы из архивов ЦБ в ряд не входят
+    weekday = (cached.days - 1) % 7 < 5
+    if not weekday.all():
+        cached = RateSeries(cached.days[weekday], cached.rates[weekday])
+    ordinals = np.arange(first, last + 1, dtype=np.int32)
+    weekdays = ordinals[(ordinals - 1) % 7 < 5]
+    # Полный день без строки валюты — «курса нет», а не пробел в кэше: не перезапрашиваем
+    complete = np.fromiter(storage.complete_days(first, last), dtype=np.int32)
+    missing = weekdays[~np.isin(weekdays, np.concatenate([cached.days, complete]))]
+    if not len(missing):
+        return cached
+
+    days, rates = [], []
+    # Длинные пробелы (годы истории) — одним запросом динамики, а не запросом на каждый день
+    if len(missing) >= DYNAMIC_MIN_DAYS:
+        fetched = _fetch_dynamic(
+            datetime.fromordinal(int(missing[0])), datetime.fromordinal(int(missing[-1])), currency
+        )
+        rest, batch = [], []
+        for day in missing.tolist():
+            rate = fetched.get(date.fromordinal(day))
+            if rate is None:
+                rest.append(day)
+                continue
+            batch.append((currency, day, rate))
+            days.append(day)
+            rates.append(rate)
+        # Дни из динамики — частичные: get_rate_matrix перезапросит их целиком через XML_daily
+        storage.put_rates(batch)
+        missing = rest
+    else:
+        missing = missing.tolist()
+
+    for day in missing:
+        rate = get_exchange_rate(datetime.fromordinal(day), currency)
+        if rate is not None:
+            days.append(day)
+            rates.append(rate)
+
+    all_days = np.concatenate([cached.days, np.array(days, dtype=np.int32)])
+    order = np.argsort(all_days, kind="stable")
+    return RateSeries(all_days[order], np.concatenate([cached.rates, np.array(rates, dtype=np.float64)])[order])
@@ -0,0 +1,146 @@
+# v3_ml_model/dataset.py
+"""Обучающий набор на диске: по файлу на столбец, чтение через memmap.
+
+    train_data/
+        X.f32      признаки, float32, строк × признаков
+        y.i1       метка «рост», int8
+        day.i4     дата строки (ordinal), int32
+        cur.U3     код валюты
+        meta.json  число строк, спецификация признаков, последняя дата каждой валюты
+
+Строки дописываются блоками в порядке дат. meta.json пишется последним и атомарно:
+прерванная запись не портит набор — недописанный хвост отрезается при следующей.
+"""
+import hashlib
+import json
+import os
+import numpy as np
+
+COLUMNS = {"X": np.float32, "y": np.int8, "day": np.int32, "cur": np.dtype("U3")}
+FILES = {"X": "X.f32", "y": "y.i1", "day": "day.i4", "cur": "cur.U3"}
+
+# Строк за одно чтение при потоковых проходах по набору
+BLOCK_ROWS = 200_000
+
+
+def read_meta(path: str) -> dict | None:
+    try:
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _row_bytes(name: str, meta: dict) -> int:
+    width = meta["n_features"] if name == "X" else 1
+    return np.dtype(COLUMNS[name]).itemsize * width
+
+
+def open_dataset(path: str) -> tuple[dict, dict] | tuple[None, None]:
+    """Столбцы набора как read-only memmap (в память попадают только читаемые срезы)."""
+    meta = read_meta(path)
+    if meta is None:
+        return None, None
+    n = meta["rows"]
+    ds = {}
+    for name, dtype in COLUMNS.items():
+        shape = (n, meta["n_features"]) if name == "X" else (n,)
+        if n == 0:
+            ds[name] = np.empty(shape, dtype=dtype)  # пустой файл memmap не открывает
+        else:
+            ds[name] = np.memmap(os.path.join(path, FILES[name]), dtype=dtype, mode="r", shape=shape)
+    return ds, meta
+
+
+def row_blocks(lo: int, hi: int, size: int = BLOCK_ROWS):
+    for start in range(lo, hi, size):
+        yield start, min(start + size, hi)
+
+
+def prefix_fingerprint(ds: dict, rows: int) -> str:
+    """Отпечаток первых rows строк (дата и валюта): дозапись его не меняет, пересборка — меняет."""
+    h = hashlib.sha1()
+    for i, j in row_blocks(0, rows):
+        h.update(np.ascontiguousarray(ds["day"][i:j]).tobytes())
+        h.update(np.ascontiguousarray(ds["cur"][i:j]).tobytes())
+    return h.hexdigest()[:12]
+
+
+def load_rows(ds: dict, lo: int, hi: int, limit: int, seed: int = 42) -> tuple[np.ndarray, np.ndarray]:
+    """Строки [lo, hi) в память; если их больше `limit` — случайная выборка `limit` строк (в порядке дат)."""
+    if hi - lo <= limit:
+        return np.array(ds["X"][lo:hi]), np.array(ds["y"][lo:hi])
+    idx = lo + np.sort(np.random.default_rng(seed).choice(hi - lo, size=limit, replace=False))
+    X = np.empty((limit, ds["X"].shape[1]), dtype=np.float32)
+    y = np.empty(limit, dtype=np.int8)
+    for i, j in row_blocks(0, limit):
+        X[i:j] = ds["X"][idx[i:j]]
+        y[i:j] = ds["y"][idx[i:j]]
+    return X, y
+
+
+class DatasetWriter:
+    """Потоковая запись набора: `with DatasetWriter(path, spec) as w: w.append(X, y, day, cur)`.
+
+    append=True дописывает к существующему набору (спецификация берётся из него),
+    иначе набор создаётся заново.
+    """
+
+    def __init__(self, path: str, spec: list[dict], append: bool = False):
+        self.path = path
+        meta = read_meta(path) if append else None
+        os.makedirs(path, exist_ok=True)
+        if meta is None:
+            # Пока идёт пересборка, набора «нет» — старая meta не должна описывать новые файлы
+            try:
+                os.remove(os.path.join(path, "meta.json"))
+            except FileNotFoundError:
+                pass
+            meta = {"rows": 0, "n_features": len(spec), "spec": spec, "last_day": {}}
+        self.meta = meta
+        self._files = {}
+        for name in COLUMNS:
+            file = os.path.join(path, FILES[name])
+            with open(file, "ab") as f:
+                f.truncate(meta["rows"] * _row_bytes(name, meta))
+            self._files[name] = open(file, "ab")
+
+    def append(self, X, y, day, cur) -> None:
+        X = np.ascontiguousarray(X, dtype=np.float32).reshape(-1, self.meta["n_features"])
+        columns = {
+            "X": X,
+            "y": np.asarray(y, dtype=np.int8),
+            "day": np.asarray(day, dtype=np.int32),
+            "cur": np.asarray(cur, dtype=COLUMNS["cur"]),
+        }
+        if any(len(col) != len(X) for col in columns.values()):
+            raise ValueError("Столбцы блока разной длины")
+        for name, col in columns.items():
+            self._files[name].write(np.ascontiguousarray(col).tobytes())
+        self.meta["rows"] += len(X)
+        last_day = self.meta["last_day"]
+        for code in np.unique(columns["cur"]):
+            newest = int(columns["day"][columns["cur"] == code].max())
+            last_day[str(code)] = max(last_day.get(str(code), 0), newest)
+
+    def close(self) -> None:
+        for f in self._files.values():
+            f.flush()
+            os.fsync(f.fileno())
+            f.close()
+        meta_path = os.path.join(self.path, "meta.json")
+        tmp = f"{meta_path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.meta, f, ensure_ascii=False)
+        os.replace(tmp, meta_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            # meta не обновляем — набор остаётся в последнем целом состоянии
+            for f in self._files.values():
+                f.close()
@@ -1,6 +1,7 @@
 # v3_ml_model/feature_engineer.py
 import numpy as np
-from datetime import datetime
+from series import RateSeries
+from indicators import DEFAULT_SPEC, feature_matrix, spec_warmup
 
 def compute_rsi(prices: list[float], period: int = 5) -> float:
     if len(prices) < period + 1:
@@ -15,29 +16,20 @@ def compute_rsi(prices: list[float], period: int = 5) -> float:
     rs = gains / losses
     return 100.0 - (100.0 / (1.0 + rs))
 
-def compute_features(dates_rates: list[tuple[datetime, float]], window=5):
-    if len(dates_rates) < window + 1:
-        return [], []
-    X, y = [], []
-    rates = [r for _, r in dates_rates]
-    for i in range(window, len(rates)):
-        window_rates = rates[i - window : i]
-        today_rate = rates[i]
-        prev_rate = rates[i - 1]
+def feature_rows(rates: np.ndarray, window=5, spec: list[dict] | None = None):
+    """Строки обучения массивами: признаки по курсам до дня i и метка «рост в день i».
 
-        delta_prev = (prev_rate - rates[i - 2]) / rates[i - 2] if i >= 2 else 0.0
+    Строка j соответствует курсу rates[len(rates) - len(X) + j].
+    """
+    spec = spec or DEFAULT_SPEC
+    start = max(window, spec_warmup(spec))
+    if len(rates) < start + 1:
+        return np.empty((0, len(spec))), np.empty(0, dtype=np.int8)
+    F = feature_matrix(rates, spec)
+    y = (rates[start:] > rates[start - 1 : -1]).astype(np.int8)
+    return F[start - 1 : -1], y
 
-        rel_changes = [
-            (window_rates[j] - window_rates[j-1]) / window_rates[j-1]
-            for j in range(1, len(window_rates))
-        ] if len(window_rates) > 1 else [0.0]
-        delta_ma = float(np.mean(rel_changes))
-        volatility = float(np.std(rel_changes)) if len(rel_changes) > 1 else 0.0
-
-        rsi = compute_rsi(rates[:i], period=5)
-
-        y_val = 1 if today_rate > prev_rate else 0
-
-        X.append([delta_prev, delta_ma, volatility, rsi])
-        y.append(y_val)
-    return X, y
\ No newline at end of file
+def compute_features(series: RateSeries, window=5, spec: list[dict] | None = None):
+    """Строки обучения: признаки по курсам до дня i (спецификация из indicators) и метка «рост в день i»."""
+    X, y = feature_rows(series.rates, window, spec)
+    return X.tolist(), y.astype(int).tolist()
@@ -0,0 +1,219 @@
+# v3_ml_model/indicators.py
+"""Библиотека индикаторов: O(n) скользящие и рекурсивные расчёты над массивами NumPy.
+
+Значение любого признака в точке t зависит только от курсов rates[:t+1].
+Набор признаков модели задаётся спецификацией — списком словарей
+{"name": <имя из реестра>, <параметры>...}; она сохраняется вместе с моделью,
+чтобы train.py и прогноз в боте считали одно и то же.
+"""
+import numpy as np
+from scipy.signal import lfilter
+
+# Текущие 4 признака модели (как в первой версии feature_engineer)
+DEFAULT_SPEC = [
+    {"name": "delta_prev"},
+    {"name": "delta_ma", "window": 5},
+    {"name": "volatility", "window": 5},
+    {"name": "rsi", "period": 5},
+]
+
+# name → (функция(rates, **params) -> массив длины n, функция(**params) -> сколько курсов нужно)
+FEATURES = {}
+
+# Рекурсивные признаки (EMA, RSI Уайлдера) зависят от всей истории. После CONVERGE_SPANS
+# длин окна вклад начала ряда меньше e^-10, и значение почти не зависит от длины истории.
+# Поэтому прогноз по spec_warmup курсам совпадает со строками обучения, у которых история — годы.
+CONVERGE_SPANS = 5
+
+
+def register(name: str, warmup):
+    def decorator(func):
+        FEATURES[name] = (func, warmup)
+        return func
+    return decorator
+
+
+# === Примитивы ===
+def pct_change(x: np.ndarray) -> np.ndarray:
+    out = np.full(len(x), np.nan)
+    out[1:] = x[1:] / x[:-1] - 1.0
+    return out
+
+
+def _shifted_cumsum(x: np.ndarray) -> np.ndarray:
+    c = np.empty(len(x) + 1)
+    c[0] = 0.0
+    np.cumsum(x, out=c[1:])
+    return c
+
+
+def rolling_mean(x: np.ndarray, window: int) -> np.ndarray:
+    """Скользящее среднее за O(n) через префиксные суммы; первые window-1 значений — NaN."""
+    out = np.full(len(x), np.nan)
+    if len(x) >= window:
+        c = _shifted_cumsum(x)
+        out[window - 1:] = (c[window:] - c[:-window]) / window
+    return out
+
+
+def rolling_std(x: np.ndarray, window: int) -> np.ndarray:
+    """Скользящее std (ddof=0) за O(n): E[x²] − E[x]² по префиксным суммам."""
+    out = np.full(len(x), np.nan)
+    if len(x) >= window and window > 1:
+        centered = x - x.mean()  # сдвиг не меняет std, но уменьшает потерю точности
+        mean = rolling_mean(centered, window)[window - 1:]
+        mean_sq = rolling_mean(centered * centered, window)[window - 1:]
+        out[window - 1:] = np.sqrt(np.maximum(mean_sq - mean * mean, 0.0))
+    elif len(x) >= window:
+        out[window - 1:] = 0.0
+    return out
+
+
+def ema(x: np.ndarray, span: float | None = None, alpha: float | None = None) -> np.ndarray:
+    """Экспоненциальное среднее рекурсией y[t] = a·x[t] + (1−a)·y[t−1], y[0] = x[0]."""
+    if alpha is None:
+        alpha = 2.0 / (span + 1.0)
+    if len(x) == 0:
+        return np.empty(0)
+    y, _ = lfilter([alpha], [1.0, alpha - 1.0], x, zi=[(1.0 - alpha) * x[0]])
+    return y
+
+
+def _ema_warmup(span: float) -> int:
+    return int(CONVERGE_SPANS * span) + 1
+
+
+def _on_changes(rates: np.ndarray, func, *args) -> np.ndarray:
+    # Изменения начинаются с t=1 — считаем по ним и возвращаем ведущий NaN на место
+    out = np.full(len(rates), np.nan)
+    if len(rates) > 1:
+        out[1:] = func(pct_change(rates)[1:], *args)
+    return out
+
+
+# === Признаки ===
+@register("delta_prev", warmup=lambda: 2)
+def delta_prev(rates: np.ndarray) -> np.ndarray:
+    """Относительное изменение за последний день."""
+    return pct_change(rates)
+
+
+@register("delta_ma", warmup=lambda window=5: window)
+def delta_ma(rates: np.ndarray, window: int = 5) -> np.ndarray:
+    """Среднее дневное изменение по последним `window` курсам (window−1 изменений)."""
+    return _on_changes(rates, rolling_mean, window - 1)
+
+
+@register("volatility", warmup=lambda window=5: window)
+def volatility(rates: np.ndarray, window: int = 5) -> np.ndarray:
+    """Std дневных изменений по последним `window` курсам."""
+    return _on_changes(rates, rolling_std, window - 1)
+
+
+@register("rsi", warmup=lambda period=5, smoothing="simple": _ema_warmup(2 * period - 1) if smoothing == "wilder" else 1)
+def rsi(rates: np.ndarray, period: int = 5, smoothing: str = "simple") -> np.ndarray:
+    """RSI: simple — средние приросты/потери за `period` дней, wilder — сглаживание Уайлдера.
+
+    Пока курсов меньше period+1, значение 50 (нейтрально), как в compute_rsi.
+    """
+    n = len(rates)
+    out = np.full(n, 50.0)
+    if n < period + 1:
+        return out
+    diffs = np.diff(rates)
+    gains = np.where(diffs > 0, diffs, 0.0)
+    losses = np.where(diffs < 0, -diffs, 0.0)
+    if smoothing == "wilder":
+        avg_gain = ema(gains, alpha=1.0 / period)[period - 1:]
+        avg_loss = ema(losses, alpha=1.0 / period)[period - 1:]
+    else:
+        avg_gain = rolling_mean(gains, period)[period - 1:]
+        avg_loss = rolling_mean(losses, period)[period - 1:]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        value = 100.0 - 100.0 / (1.0 + avg_gain / avg_loss)
+    value = np.where(avg_loss == 0, 100.0, np.where(avg_gain == 0, 0.0, value))
+    out[period:] = value
+    return out
+
+
+@register("momentum", warmup=lambda window=10: window + 1)
+def momentum(rates: np.ndarray, window: int = 10) -> np.ndarray:
+    """Изменение за `window` дней: r[t] / r[t−window] − 1."""
+    out = np.full(len(rates), np.nan)
+    out[window:] = rates[window:] / rates[:-window] - 1.0
+    return out
+
+
+@register("ema_gap", warmup=lambda span=10: _ema_warmup(span))
+def ema_gap(rates: np.ndarray, span: int = 10) -> np.ndarray:
+    """Отклонение курса от EMA(span), в долях."""
+    return rates / ema(rates, span) - 1.0
+
+
+@register("macd", warmup=lambda fast=12, slow=26: _ema_warmup(slow))
+def macd(rates: np.ndarray, fast: int = 12, slow: int = 26) -> np.ndarray:
+    """MACD, нормированный на курс: (EMA_fast − EMA_slow) / EMA_slow — сравним между валютами."""
+    slow_ema = ema(rates, slow)
+    return (ema(rates, fast) - slow_ema) / slow_ema
+
+
+@register("macd_hist", warmup=lambda fast=12, slow=26, signal=9: _ema_warmup(slow + signal))
+def macd_hist(rates: np.ndarray, fast: int = 12, slow: int = 26, signal: int = 9) -> np.ndarray:
+    """Гистограмма MACD: MACD − EMA(signal) от MACD."""
+    line = macd(rates, fast, slow)
+    return line - ema(line, signal)
+
+
+@register("bollinger_width", warmup=lambda window=20, k=2.0: window)
+def bollinger_width(rates: np.ndarray, window: int = 20, k: float = 2.0) -> np.ndarray:
+    """Ширина полос Боллинджера относительно средней: 2·k·std / mean."""
+    return 2.0 * k * rolling_std(rates, window) / rolling_mean(rates, window)
+
+
+# === Спецификация ===
+def _params(entry: dict) -> dict:
+    return {key: value for key, value in entry.items() if key != "name"}
+
+
+def validate_spec(spec: list[dict]) -> None:
+    for entry in spec:
+        if entry.get("name") not in FEATURES:
+            raise ValueError(f"Неизвестный признак: {entry.get('name')} (доступны: {', '.join(FEATURES)})")
+
+
+def feature_names(spec: list[dict]) -> list[str]:
+    """delta_prev, rsi(period=14, smoothing=wilder), …"""
+    names = []
+    for entry in spec:
+        params = _params(entry)
+        suffix = ", ".join(f"{k}={v}" for k, v in params.items())
+        names.append(f"{entry['name']}({suffix})" if suffix else entry["name"])
+    return names
+
+
+def spec_warmup(spec: list[dict]) -> int:
+    """Сколько курсов нужно, чтобы все признаки спецификации были определены (рекурсивные — сошлись)."""
+    return max(FEATURES[entry["name"]][1](**_params(entry)) for entry in spec)
+
+
+def history_days(spec: list[dict], min_rates: int = 0) -> int:
+    """Календарных дней истории, в которых заведомо есть spec_warmup курсов (будни + праздники).
+
+    Один горизонт для прогноза (model.py) и для сборки строк обучения (train.py).
+    """
+    return max(min_rates, spec_warmup(spec)) * 3 // 2 + 10
+
+
+def feature_matrix(rates, spec: list[dict] = DEFAULT_SPEC) -> np.ndarray:
+    """Матрица n × k: строка t — признаки по курсам rates[:t+1]."""
+    validate_spec(spec)
+    rates = np.asarray(rates, dtype=np.float64)
+    columns = [FEATURES[entry["name"]][0](rates, **_params(entry)) for entry in spec]
+    return np.column_stack(columns) if columns else np.empty((len(rates), 0))
+
+
+def latest_features(rates, spec: list[dict] = DEFAULT_SPEC) -> np.ndarray | None:
+    """Признаки по всей истории — вход модели для прогноза на следующий день."""
+    if len(rates) < spec_warmup(spec):
+        return None
+    return feature_matrix(rates, spec)[-1]
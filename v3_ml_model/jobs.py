@@ -0,0 +1,138 @@
+# v3_ml_model/jobs.py
+"""Очередь тяжёлых задач бота с классами приоритета и квотой на пользователя.
+
+Тяжёлый запрос (график за годы) не держит слот обработки апдейтов: обработчик ставит
+задачу в очередь и сразу отвечает, а задачу выполняет один из `workers` фоновых
+исполнителей. Из очереди берётся самая приоритетная задача (меньшее число — раньше,
+внутри класса — по порядку поступления), чей пользователь не занял уже `per_user`
+исполнителей; всего у пользователя принимается не больше `max_pending` задач.
+"""
+import asyncio
+import contextvars
+import logging
+import time
+from collections import Counter, deque
+
+logger = logging.getLogger(__name__)
+
+# Классы приоритета
+HIGH, LOW = 0, 1
+PRIORITY_NAMES = {HIGH: "high", LOW: "low"}
+
+# Сколько последних задач класса хранить для статистики ожидания/выполнения
+STATS_WINDOW = 1000
+
+
+class Job:
+    def __init__(self, user: int, priority: int, name: str, func, args):
+        self.user = user
+        self.priority = priority
+        self.name = name
+        self.func = func
+        self.args = args
+        self.created = time.monotonic()
+        self.started = None
+
+
+class JobScheduler:
+    def __init__(self, workers: int = 2, per_user: int = 1, max_pending: int = 3):
+        self.workers = workers
+        self.per_user = per_user
+        self.max_pending = max_pending
+        self._queues = {priority: deque() for priority in PRIORITY_NAMES}
+        self._running = Counter()  # пользователь → задач у исполнителей
+        self._pending = Counter()  # пользователь → принятых и не завершённых
+        self._cond = asyncio.Condition()
+        self._tasks = []
+        self._closed = False
+        self._stats = {priority: deque(maxlen=STATS_WINDOW) for priority in PRIORITY_NAMES}
+
+    @property
+    def closed(self) -> bool:
+        """Очередь остановлена drain() и новых задач не принимает."""
+        return self._closed
+
+    def pending(self, user: int | None = None) -> int:
+        """Принятые и не завершённые задачи: все или одного пользователя."""
+        return self._pending[user] if user is not None else sum(self._pending.values())
+
+    def ahead(self, priority: int) -> int:
+        """Сколько задач в очереди будет взято раньше новой задачи класса priority."""
+        return sum(len(q) for p, q in self._queues.items() if p <= priority)
+
+    async def submit(self, user: int, priority: int, name: str, func, *args) -> Job | None:
+        """Ставит `await func(*args)` в очередь; None — квота пользователя исчерпана или очередь закрыта."""
+        if self._closed or self._pending[user] >= self.max_pending:
+            return None
+        if not self._tasks:
+            self._start()
+        job = Job(user, priority, name, func, args)
+        async with self._cond:
+            self._queues[priority].append(job)
+            self._pending[user] += 1
+            self._cond.notify_all()
+        return job
+
+    def _start(self) -> None:
+        loop = asyncio.get_running_loop()
+        # Пустой контекст: иначе исполнители унаследуют contextvars обработчика,
+        # в котором их запустили (например, сессию профилирования)
+        self._tasks = [
+            contextvars.Context().run(loop.create_task, self._worker(), name=f"job-worker-{i}")
+            for i in range(self.workers)
+        ]
+
+    def _take(self) -> Job | None:
+        for queue in self._queues.values():
+            for job in queue:
+                if self._running[job.user] < self.per_user:
+                    queue.remove(job)
+                    self._running[job.user] += 1
+                    return job
+        return None
+
+    async def _worker(self) -> None:
+        while True:
+            async with self._cond:
+                job = await self._cond.wait_for(self._take)
+            job.started = time.monotonic()
+            try:
+                await job.func(*job.args)
+            except Exception:
+                logger.exception(f"Задача {job.name} (пользователь {job.user}) завершилась с ошибкой")
+            finally:
+                self._stats[job.priority].append((job.started - job.created, time.monotonic() - job.started))
+                async with self._cond:
+                    self._running[job.user] -= 1
+                    self._pending[job.user] -= 1
+                    self._running += Counter()  # убрать нулевые счётчики
+                    self._pending += Counter()
+                    self._cond.notify_all()
+
+    async def drain(self) -> None:
+        """Перестаёт принимать задачи, дожидается уже принятых и останавливает исполнителей."""
+        self._closed = True
+        if self._tasks:
+            async with self._cond:
+                await self._cond.wait_for(lambda: not self._pending)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def stats(self) -> dict:
+        """По классам: число задач, медиана и p90 ожидания в очереди и выполнения, с."""
+        def pct(values, q):
+            values = sorted(values)
+            return values[min(len(values) - 1, int(q * len(values)))] if values else float("nan")
+
+        report = {}
+        for priority, samples in self._stats.items():
+            waits = [w for w, _ in samples]
+            runs = [r for _, r in samples]
+            report[PRIORITY_NAMES[priority]] = {
+                "n": len(samples),
+                "wait_p50": pct(waits, 0.5), "wait_p90": pct(waits, 0.9),
+                "run_p50": pct(runs, 0.5), "run_p90": pct(runs, 0.9),
+            }
+        return report
@@ -0,0 +1,407 @@
+# v3_ml_model/loadtest.py
+"""Нагрузочный тест v3-бота: много одновременных пользователей /predict, /advice, /list.
+
+Настоящие обработчики из bot.py работают против поддельных Bot API и ЦБ РФ,
+поднятых в отдельных процессах. Пример:
+
+    python loadtest.py --users 50 --duration 30 --mix predict=5,advice=3,list=2 --popularity zipf:1.2
+
+Команда heavy в смеси — /predict за долгий период (--heavy-arg), уходит в очередь задач бота;
+её задержка в таблице — до ответа «⏳ …», а ожидание и выполнение самих задач — в сводке очереди.
+"""
+import argparse
+import asyncio
+import gc
+import json
+import logging
+import math
+import multiprocessing
+import os
+import random
+import resource
+import tempfile
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+logger = logging.getLogger("loadtest")
+
+FAKE_CURRENCIES = [
+    ("USD", "Доллар США", 1, 90.0), ("EUR", "Евро", 1, 98.0),
+    ("CNY", "Китайский юань", 1, 12.4), ("GBP", "Фунт стерлингов", 1, 114.0),
+    ("JPY", "Японских иен", 100, 61.0), ("CHF", "Швейцарский франк", 1, 101.0),
+    ("KZT", "Казахстанских тенге", 100, 18.9), ("TRY", "Турецких лир", 10, 27.6),
+    ("AED", "Дирхам ОАЭ", 1, 24.5), ("INR", "Индийских рупий", 10, 10.8),
+    ("BYN", "Белорусский рубль", 1, 27.8), ("AMD", "Армянских драмов", 100, 23.1),
+    ("HKD", "Гонконгский доллар", 1, 11.5), ("SEK", "Шведских крон", 10, 86.0),
+    ("PLN", "Польский злотый", 1, 22.6), ("CAD", "Канадский доллар", 1, 66.0),
+]
+
+
+# === Поддельный ЦБ РФ ===
+def _fake_rate(code: str, base: float, ordinal: int) -> float:
+    phase = sum(map(ord, code))
+    noise = random.Random(ordinal * 7919 + phase).gauss(0.0, 0.004)
+    return base * (1.0 + 0.05 * math.sin(ordinal / 23.0 + phase) + noise)
+
+
+def _cbr_xml(day: datetime) -> bytes:
+    valutes = []
+    for i, (code, name, nominal, base) in enumerate(FAKE_CURRENCIES):
+        value = f"{_fake_rate(code, base, day.toordinal()) * nominal:.4f}".replace(".", ",")
+        valutes.append(
+            f'<Valute ID="R{i:05d}"><NumCode>{i:03d}</NumCode><CharCode>{code}</CharCode>'
+            f"<Nominal>{nominal}</Nominal><Name>{name}</Name><Value>{value}</Value></Valute>"
+        )
+    return (
+        f'<?xml version="1.0" encoding="UTF-8"?><ValCurs Date="{day:%d.%m.%Y}" name="Foreign Currency Market">'
+        + "".join(valutes)
+        + "</ValCurs>"
+    ).encode("utf-8")
+
+
+def _cbr_dynamic_xml(val_id: str, start: datetime, end: datetime) -> bytes:
+    records = []
+    index = int(val_id[1:]) if val_id[1:].isdigit() else -1
+    # Незнакомый ID (напр. настоящий R01235 из DEFAULT_CURRENCY_IDS) — пустая динамика
+    ordinals = range(start.toordinal(), end.toordinal() + 1) if 0 <= index < len(FAKE_CURRENCIES) else ()
+    for ordinal in ordinals:
+        code, _, nominal, base = FAKE_CURRENCIES[index]
+        day = datetime.fromordinal(ordinal)
+        if day.weekday() < 5:
+            value = f"{_fake_rate(code, base, ordinal) * nominal:.4f}".replace(".", ",")
+            records.append(
+                f'<Record Date="{day:%d.%m.%Y}" Id="{val_id}"><Nominal>{nominal}</Nominal>'
+                f"<Value>{value}</Value></Record>"
+            )
+    return (
+        f'<?xml version="1.0" encoding="UTF-8"?><ValCurs ID="{val_id}" name="Foreign Currency Market Dynamic">'
+        + "".join(records)
+        + "</ValCurs>"
+    ).encode("utf-8")
+
+
+class _FakeCBRHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path.endswith("XML_dynamic.asp"):
+            body = _cbr_dynamic_xml(
+                query["VAL_NM_RQ"][0],
+                datetime.strptime(query["date_req1"][0], "%d/%m/%Y"),
+                datetime.strptime(query["date_req2"][0], "%d/%m/%Y"),
+            )
+        else:
+            day = datetime.now()
+            if "date_req" in query:
+                day = datetime.strptime(query["date_req"][0], "%d/%m/%Y")
+            body = _cbr_xml(day)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/xml")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+# === Поддельный Bot API ===
+class _FakeBotAPIHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+    _message_id = 1000
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        time.sleep(self.latency)
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        method = self.path.rsplit("/", 1)[-1]
+        if method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "loadtest", "username": "loadtest_bot"}
+        elif method.startswith(("send", "edit")):
+            _FakeBotAPIHandler._message_id += 1
+            result = {
+                "message_id": _FakeBotAPIHandler._message_id,
+                "date": int(time.time()),
+                "chat": {"id": 1, "type": "private"},
+                "text": "ok",
+            }
+            if method == "sendPhoto":
+                file_id = f"photo{_FakeBotAPIHandler._message_id}"
+                result["photo"] = [{"file_id": file_id, "file_unique_id": file_id, "width": 768, "height": 384}]
+        else:
+            result = True
+        body = json.dumps({"ok": True, "result": result}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def _serve(handler_cls, port: int, latency: float) -> None:
+    handler_cls.latency = latency
+    ThreadingHTTPServer(("127.0.0.1", port), handler_cls).serve_forever()
+
+
+def start_fake_servers(cbr_port: int, api_port: int, cbr_latency: float, api_latency: float):
+    """Запускает поддельные ЦБ РФ и Bot API в отдельных процессах (не делят GIL с ботом)."""
+    procs = [
+        multiprocessing.Process(target=_serve, args=(_FakeCBRHandler, cbr_port, cbr_latency), daemon=True),
+        multiprocessing.Process(target=_serve, args=(_FakeBotAPIHandler, api_port, api_latency), daemon=True),
+    ]
+    for p in procs:
+        p.start()
+    time.sleep(0.5)
+    return procs
+
+
+# === Синтетические пользователи ===
+def parse_mix(spec: str) -> dict[str, float]:
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip().lstrip("/")] = float(weight or 1)
+    return mix
+
+
+def popularity_weights(spec: str, n: int) -> np.ndarray:
+    """uniform или zipf:<s> — вес i-й валюты ∝ 1 / (i+1)^s."""
+    if spec == "uniform":
+        w = np.ones(n)
+    elif spec.startswith("zipf"):
+        s = float(spec.partition(":")[2] or 1.0)
+        w = 1.0 / np.arange(1, n + 1) ** s
+    else:
+        raise ValueError(f"Неизвестное распределение популярности: {spec}")
+    return w / w.sum()
+
+
+def make_update(update_id: int, user_id: int, text: str) -> dict:
+    command = text.split()[0]
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+            "text": text,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(command)}],
+        },
+    }
+
+
+def command_text(command: str, currency: str, predict_arg: str, heavy_arg: str) -> str:
+    if command == "predict":
+        return f"/predict {currency} {predict_arg}"
+    if command == "heavy":
+        return f"/predict {currency} {heavy_arg}"
+    if command == "advice":
+        return f"/advice {currency}"
+    return f"/{command}"
+
+
+async def _loop_lag_monitor(samples: list[float], stop: asyncio.Event, interval: float = 0.05):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        t0 = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, loop.time() - t0 - interval))
+
+
+def _rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _pct(values, q) -> float:
+    return float(np.percentile(values, q)) * 1000 if len(values) else float("nan")
+
+
+async def run_load(args) -> dict:
+    from telegram import Update
+    from telegram.ext import TypeHandler
+    import bot
+
+    app = bot.build_app()
+    done: dict[int, asyncio.Future] = {}
+
+    async def mark_done(update: Update, context) -> None:
+        fut = done.pop(update.update_id, None)
+        if fut and not fut.done():
+            fut.set_result(None)
+
+    # Группа после основных обработчиков — срабатывает, когда апдейт обработан целиком
+    app.add_handler(TypeHandler(Update, mark_done), group=99)
+
+    await app.initialize()
+    await app.start()
+    client = None
+    if args.webhook:
+        import httpx
+
+        await app.updater.start_webhook(
+            listen="127.0.0.1", port=args.webhook_port, url_path="telegram",
+            max_connections=bot.MAX_CONCURRENT_UPDATES,
+        )
+        client = httpx.AsyncClient(timeout=120)
+
+    currencies = [c[0] for c in FAKE_CURRENCIES]
+    cum_weights = np.cumsum(popularity_weights(args.popularity, len(currencies)))
+    mix = parse_mix(args.mix)
+    commands, cmd_weights = list(mix), list(mix.values())
+    latencies: dict[str, list[float]] = {c: [] for c in commands}
+    errors = 0
+    next_id = iter(range(1, 10**9))
+    loop = asyncio.get_running_loop()
+
+    async def send(payload: dict) -> None:
+        if client is not None:
+            await client.post(f"http://127.0.0.1:{args.webhook_port}/telegram", json=payload)
+        else:
+            await app.update_queue.put(Update.de_json(payload, app.bot))
+
+    async def user(user_id: int, deadline: float) -> None:
+        nonlocal errors
+        rnd = random.Random(args.seed + user_id)
+        while loop.time() < deadline:
+            command = rnd.choices(commands, cmd_weights)[0]
+            currency = currencies[min(int(np.searchsorted(cum_weights, rnd.random())), len(currencies) - 1)]
+            update_id = next(next_id)
+            fut = loop.create_future()
+            done[update_id] = fut
+            t0 = loop.time()
+            try:
+                await send(make_update(update_id, user_id, command_text(command, currency, args.predict_arg, args.heavy_arg)))
+                await asyncio.wait_for(fut, timeout=args.timeout)
+                latencies[command].append(loop.time() - t0)
+            except Exception:
+                done.pop(update_id, None)
+                errors += 1
+            if args.think > 0:
+                await asyncio.sleep(rnd.expovariate(1.0 / args.think))
+
+    lag: list[float] = []
+    stop = asyncio.Event()
+    monitor = asyncio.create_task(_loop_lag_monitor(lag, stop))
+    gc.collect()
+    rss_start = _rss_mb()
+    t_start = loop.time()
+    deadline = t_start + args.duration
+    await asyncio.gather(*(user(1000 + i, deadline) for i in range(args.users)))
+    elapsed = loop.time() - t_start
+    stop.set()
+    await bot.JOBS.drain()  # тяжёлые задачи, принятые до конца теста
+    await monitor
+    gc.collect()
+    rss_end = _rss_mb()
+
+    if client is not None:
+        await client.aclose()
+        await app.updater.stop()
+    await app.stop()
+    await app.shutdown()
+
+    all_lat = [x for v in latencies.values() for x in v]
+    return {
+        "users": args.users,
+        "elapsed_s": round(elapsed, 2),
+        "completed": len(all_lat),
+        "errors": errors,
+        "throughput_rps": round(len(all_lat) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            name: {"n": len(v), "p50": _pct(v, 50), "p90": _pct(v, 90), "p99": _pct(v, 99)}
+            for name, v in {**latencies, "all": all_lat}.items()
+        },
+        "loop_lag_ms": {"p50": _pct(lag, 50), "p99": _pct(lag, 99), "max": max(lag, default=0.0) * 1000},
+        "jobs": bot.JOBS.stats(),
+        "rss_mb": {"start": round(rss_start, 1), "end": round(rss_end, 1), "growth": round(rss_end - rss_start, 1)},
+    }
+
+
+def print_report(report: dict) -> None:
+    print(f"\n👥 Пользователей: {report['users']} | время: {report['elapsed_s']} с")
+    print(f"✅ Выполнено: {report['completed']} | ошибок: {report['errors']} | {report['throughput_rps']} запр./с")
+    print(f"{'команда':<10}{'n':>7}{'p50, мс':>10}{'p90, мс':>10}{'p99, мс':>10}")
+    for name, s in report["latency_ms"].items():
+        print(f"{name:<10}{s['n']:>7}{s['p50']:>10.1f}{s['p90']:>10.1f}{s['p99']:>10.1f}")
+    for name, s in report["jobs"].items():
+        if s["n"]:
+            print(
+                f"🧱 Задачи {name}: {s['n']} | ожидание p50 {s['wait_p50'] * 1000:.0f} / p90 {s['wait_p90'] * 1000:.0f} мс"
+                f" | выполнение p50 {s['run_p50'] * 1000:.0f} / p90 {s['run_p90'] * 1000:.0f} мс"
+            )
+    lag = report["loop_lag_ms"]
+    print(f"⏱ Задержка event loop: p50 {lag['p50']:.1f} мс, p99 {lag['p99']:.1f} мс, max {lag['max']:.1f} мс")
+    rss = report["rss_mb"]
+    print(f"💾 RSS: {rss['start']} → {rss['end']} МБ ({rss['growth']:+} МБ)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест v3-бота")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=20.0, help="секунд")
+    parser.add_argument("--mix", default="predict=5,advice=3,list=2")
+    parser.add_argument("--popularity", default="zipf:1.2", help="uniform | zipf:<s>")
+    parser.add_argument("--predict-arg", default="7", help="аргумент периода для /predict")
+    parser.add_argument("--heavy-arg", default="2019–2024", help="период для команды heavy")
+    parser.add_argument("--think", type=float, default=0.5, help="средняя пауза пользователя, с")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--concurrency", type=int, default=None, help="BOT_CONCURRENCY")
+    parser.add_argument("--cbr-latency", type=float, default=0.02, help="задержка ЦБ РФ, с")
+    parser.add_argument("--api-latency", type=float, default=0.01, help="задержка Bot API, с")
+    parser.add_argument("--cache-dir", default=None, help="по умолчанию — временный каталог (холодный кэш)")
+    parser.add_argument("--webhook", action="store_true", help="слать апдейты POST-запросами на вебхук")
+    parser.add_argument("--webhook-port", type=int, default=8555)
+    parser.add_argument("--cbr-port", type=int, default=8090)
+    parser.add_argument("--api-port", type=int, default=8091)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", help="сохранить отчёт в JSON")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    procs = start_fake_servers(args.cbr_port, args.api_port, args.cbr_latency, args.api_latency)
+
+    # bot.py читает настройки из окружения при импорте
+    os.environ["BOT_TOKEN"] = "123456:loadtest"
+    os.environ["BOT_API_URL"] = f"http://127.0.0.1:{args.api_port}/bot"
+    if args.concurrency:
+        os.environ["BOT_CONCURRENCY"] = str(args.concurrency)
+
+    import data_loader
+    import storage
+
+    data_loader.CBR_DAILY_URL = f"http://127.0.0.1:{args.cbr_port}/scripts/XML_daily.asp"
+    data_loader.CBR_DYNAMIC_URL = f"http://127.0.0.1:{args.cbr_port}/scripts/XML_dynamic.asp"
+    storage.DB_PATH = Path(args.cache_dir or tempfile.mkdtemp(prefix="cbr_cache_")) / "bot.sqlite3"
+    data_loader.get_all_currencies(refresh=True)  # коды валют (Valute ID) поддельного ЦБ
+    for name in ("bot", "data_loader", "httpx", "telegram", "telegram.ext"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    try:
+        report = asyncio.run(run_load(args))
+    finally:
+        for p in procs:
+            p.terminate()
+
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
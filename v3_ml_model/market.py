@@ -0,0 +1,154 @@
+# v3_ml_model/market.py
+import threading
+import numpy as np
+from datetime import datetime, timedelta
+from data_loader import get_rate_matrix
+from cross_rates import BASE_CURRENCY, cross_rates, parse_symbol
+
+# Календарных дней истории для индикаторов (≈14 рабочих — хватает на Δ7 и vol_7)
+INDICATOR_DAYS = 20
+
+_TABLE = None
+_TABLE_LOCK = threading.Lock()
+
+
+def _ffill(matrix: np.ndarray) -> np.ndarray:
+    """Заполняет пропуски по датам последним известным курсом (векторно, по столбцам)."""
+    mask = np.isnan(matrix)
+    if not mask.any():
+        return matrix
+    idx = np.where(~mask, np.arange(len(matrix))[:, None], 0)
+    np.maximum.accumulate(idx, axis=0, out=idx)
+    filled = matrix[idx, np.arange(matrix.shape[1])]
+    # Ведущие NaN (валюта появилась позже) остаются NaN
+    return filled
+
+
+def compute_indicator_table(
+    dates: list[datetime], codes: list[str], matrix: np.ndarray, rsi_period: int = 5
+) -> dict:
+    """Индикаторы по всем валютам за один векторный проход по матрице дата × валюта.
+
+    Возвращает столбцы-массивы: rate, d1, d3, d7 (в %, к 2-й/3-й/7-й с конца точке),
+    vol_7 (std последних 7 дневных изменений, %), rsi (RSI по `rsi_period` изменениям).
+    """
+    m = _ffill(matrix)
+    n, k = m.shape
+    nan = np.full(k, np.nan)
+    last = m[-1] if n else nan
+
+    def delta(back: int) -> np.ndarray:
+        return (last / m[-back] - 1.0) * 100 if n >= back else nan
+
+    changes = m[1:] / m[:-1] - 1.0
+    vol_7 = np.std(changes[-7:], axis=0) * 100 if len(changes) > 1 else np.zeros(k)
+
+    if n >= rsi_period + 1:
+        diffs = np.diff(m[-(rsi_period + 1):], axis=0)
+        gains = np.where(diffs > 0, diffs, 0.0).sum(axis=0) / rsi_period
+        losses = -np.where(diffs < 0, diffs, 0.0).sum(axis=0) / rsi_period
+        with np.errstate(divide="ignore", invalid="ignore"):
+            rsi = 100.0 - 100.0 / (1.0 + gains / losses)
+        rsi = np.where(losses == 0, 100.0, np.where(gains == 0, 0.0, rsi))
+        rsi = np.where(np.isnan(diffs).any(axis=0), np.nan, rsi)
+    else:
+        rsi = np.full(k, 50.0)
+
+    return {
+        "date": dates[-1] if dates else None,
+        "codes": list(codes),
+        "index": {code: i for i, code in enumerate(codes)},
+        "rate": last,
+        "d1": delta(2),
+        "d3": delta(3),
+        "d7": delta(7),
+        "vol_7": vol_7,
+        "rsi": rsi,
+    }
+
+
+def get_indicator_table(refresh: bool = False) -> dict | None:
+    """Таблица индикаторов, пересчитываемая один раз на публикацию курсов ЦБ (раз в день)."""
+    global _TABLE
+    today = datetime.now().date()
+    with _TABLE_LOCK:
+        if _TABLE is None or refresh or _TABLE["built"] != today:
+            end = datetime.now()
+            dates, codes, matrix = get_rate_matrix(end - timedelta(days=INDICATOR_DAYS), end)
+            if len(dates) < 3:
+                return _TABLE
+            _TABLE = compute_indicator_table(dates, codes, matrix)
+            _TABLE.update(built=today, dates=dates, matrix=matrix, pairs={})
+        return _TABLE
+
+
+def _pair_table(table: dict, base: str, quote: str) -> dict | None:
+    """Индикаторы кросс-пары из той же матрицы курсов — без новых загрузок, с ленивым кэшем."""
+    key = f"{base}/{quote}"
+    with _TABLE_LOCK:
+        if key not in table["pairs"]:
+            index, m = table["index"], table["matrix"]
+            if any(c != BASE_CURRENCY and c not in index for c in (base, quote)):
+                return None
+            ones = np.ones(len(m))
+            col = cross_rates(
+                m[:, index[base]] if base != BASE_CURRENCY else ones,
+                m[:, index[quote]] if quote != BASE_CURRENCY else ones,
+            )
+            table["pairs"][key] = compute_indicator_table(table["dates"], [key], col[:, None])
+        return table["pairs"][key]
+
+
+def get_indicators(symbol: str) -> dict | None:
+    """Строка таблицы для валюты или пары ('EUR/USD'): {date, rate, d1, d3, d7, vol_7, rsi}."""
+    table = get_indicator_table()
+    if not table:
+        return None
+    base, quote = parse_symbol(symbol)
+    if quote == BASE_CURRENCY:
+        i = table["index"].get(base)
+    else:
+        table, i = _pair_table(table, base, quote), 0
+    if table is None or i is None or np.isnan(table["rate"][i]):
+        return None
+    row = {
+        name: float(np.nan_to_num(table[name][i]))
+        for name in ("rate", "d1", "d3", "d7", "vol_7")
+    }
+    row["rsi"] = float(np.nan_to_num(table["rsi"][i], nan=50.0))
+    row["date"] = table["date"]
+    return row
+
+
+def volatility_level(vol: float) -> str:
+    return "низкая" if vol < 0.5 else "средняя" if vol < 1.2 else "высокая"
+
+
+def rsi_status(rsi: float) -> str:
+    return "перекупленность" if rsi > 70 else "перепроданность" if rsi < 30 else "нейтрально"
+
+
+def rank_market(by: str = "d7", top: int = 5) -> dict | None:
+    """Лидеры роста/падения по `by` и самые волатильные валюты."""
+    table = get_indicator_table()
+    if not table:
+        return None
+    codes = np.array(table["codes"], dtype=object)
+    move, vol = table[by], table["vol_7"]
+
+    valid = ~np.isnan(move)
+    order = np.argsort(move[valid])
+    moved = codes[valid]
+    gainers = [(c, float(v)) for c, v in zip(moved[order[::-1]], move[valid][order[::-1]]) if v > 0]
+    losers = [(c, float(v)) for c, v in zip(moved[order], move[valid][order]) if v < 0]
+
+    valid = ~np.isnan(vol)
+    order = np.argsort(vol[valid])[::-1]
+    volatile = [(c, float(v)) for c, v in zip(codes[valid][order], vol[valid][order])]
+
+    return {
+        "date": table["date"],
+        "gainers": gainers[:top],
+        "losers": losers[:top],
+        "volatile": volatile[:top],
+    }
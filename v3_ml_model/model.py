@@ -1,29 +1,90 @@
 # v3_ml_model/model.py
+import logging
+import os
+import threading
 import joblib
 import numpy as np
 from datetime import datetime, timedelta
-from data_loader import get_rates_range
-from feature_engineer import compute_features, compute_rsi
+import storage
+from cross_rates import get_series, symbol_name
+from indicators import DEFAULT_SPEC, history_days, latest_features
+from market import get_indicators, volatility_level
 
-def predict_trend(currency: str) -> dict | None:
+logger = logging.getLogger(__name__)
+
+MODEL_PATH = "model_all.pkl"
+
+_ARTIFACT = None
+_ARTIFACT_MTIME = None
+_ARTIFACT_LOCK = threading.Lock()
+
+
+def load_model() -> dict | None:
+    """{"model": классификатор, "features": спецификация признаков, "version": ...} из MODEL_PATH.
+
+    Перечитывается только при изменении файла (после train.py). Старый формат —
+    голый классификатор — считается обученным на DEFAULT_SPEC. Если файл не читается
+    (повреждён или записан не атомарно), остаётся предыдущая загруженная модель.
+    """
+    global _ARTIFACT, _ARTIFACT_MTIME
     try:
-        model = joblib.load("model_all.pkl")
-    except FileNotFoundError:
+        mtime = os.stat(MODEL_PATH).st_mtime_ns
+    except OSError:
+        return None
+    with _ARTIFACT_LOCK:
+        if mtime != _ARTIFACT_MTIME:
+            try:
+                artifact = joblib.load(MODEL_PATH)
+            except Exception as e:
+                # mtime не запоминаем — следующий вызов попробует снова
+                logger.warning(f"Не удалось загрузить {MODEL_PATH}: {e}; остаётся предыдущая модель")
+                return _ARTIFACT
+            if not isinstance(artifact, dict):
+                artifact = {"model": artifact, "features": DEFAULT_SPEC}
+            # Версия — время записи файла: одинакова во всех процессах, читающих этот файл
+            artifact["version"] = str(mtime)
+            _ARTIFACT, _ARTIFACT_MTIME = artifact, mtime
+        return _ARTIFACT
+
+
+def predict_trend(currency: str) -> dict | None:
+    """Прогноз направления на завтра для валюты ('USD') или кросс-пары ('EUR/USD')."""
+    artifact = load_model()
+    if not artifact:
         return None
+    model, spec = artifact["model"], artifact["features"]
 
+    # Истории — с запасом на выходные под самый длинный индикатор спецификации
     end = datetime.now()
-    start = end - timedelta(days=20)
-    data = get_rates_range(start, end, currency)
+    start = end - timedelta(days=max(20, history_days(spec)))
+    data = get_series(start, end, currency)
     if len(data) < 7:
         return None
 
-    recent = data[-7:]
-    X, _ = compute_features(recent, window=5)
-    if not X:
+    # Готовый прогноз из общей БД: тот же символ, последний курс и версия модели
+    symbol, day = symbol_name(currency), int(data.days[-1])
+    cached = storage.get_prediction(symbol, day, artifact["version"])
+    if cached:
+        return cached
+
+    # Признаки по всей истории, включая последний курс, — как строки обучения для следующего дня
+    x = latest_features(data.rates, spec)
+    if x is None or np.isnan(x).any():
         return None
 
-    proba = model.predict_proba([X[-1]])[0]
-    pred = model.predict([X[-1]])[0]
+    result = _predict(model, spec, x)
+    storage.put_prediction(symbol, day, artifact["version"], result)
+    return result
+
+
+def precompute_predictions(symbols: list[str]) -> int:
+    """Считает прогнозы заранее (после обучения) — реплики бота берут их из БД."""
+    return sum(predict_trend(symbol) is not None for symbol in symbols)
+
+
+def _predict(model, spec: list[dict], x: np.ndarray) -> dict:
+    proba = model.predict_proba([x])[0]
+    pred = model.predict([x])[0]
     raw_conf = float(proba[pred])
     trend = "вверх" if pred == 1 else "вниз"
 
@@ -42,7 +103,13 @@ def predict_trend(currency: str) -> dict | None:
             "reason": "противоречивые факторы: тренд и волатильность"
         }
 
-    delta_prev, delta_ma, volatility, rsi = X[-1]
+    # Пояснения — по признакам базовой спецификации, если они в неё входят
+    named = {}
+    for entry, value in zip(spec, x):
+        named.setdefault(entry["name"], float(value))
+    delta_prev = named.get("delta_prev", 0.0)
+    volatility = named.get("volatility", 0.008)
+    rsi = named.get("rsi", 50.0)
     details = []
     if delta_prev > 0:
         details.append("рост вчера")
@@ -67,23 +134,18 @@ def predict_trend(currency: str) -> dict | None:
 
 
 def get_advice(currency: str) -> str | None:
-    end = datetime.now()
-    start = end - timedelta(days=15)
-    data = get_rates_range(start, end, currency)
-    if len(data) < 5:
+    ind = get_indicators(currency)
+    if not ind:
         return None
 
-    rates = [r for _, r in data]
-    changes = [(rates[i] - rates[i-1]) / rates[i-1] for i in range(1, len(rates))]
-    vol = (sum(x**2 for x in changes[-5:]) / 5) ** 0.5 * 100
-    delta_1d = (rates[-1] - rates[-2]) / rates[-2] * 100 if len(rates) >= 2 else 0.0
-    delta_7d = (rates[-1] - rates[-7]) / rates[-7] * 100 if len(rates) >= 7 else 0.0
+    vol_level = volatility_level(ind["vol_7"])
+    delta_1d, delta_7d = ind["d1"], ind["d7"]
 
     lines = []
 
-    if vol > 1.5:
+    if vol_level == "высокая":
         lines.append("❗ Высокая волатильность — возможны резкие движения.")
-    elif vol < 0.4:
+    elif vol_level == "низкая":
         lines.append("ℹ️ Низкая волатильность — рынок в диапазоне.")
 
     if delta_1d > 1.0:
@@ -1,14 +1,33 @@
 import io
 import re
+import threading
 import matplotlib
 matplotlib.use('Agg')
+import matplotlib.dates as mdates
 import matplotlib.pyplot as plt
+import numpy as np
 from datetime import datetime, timedelta
 
-from data_loader import get_rates_range
+from cross_rates import get_series, parse_symbol, symbol_name
+
+# pyplot хранит глобальное состояние — при параллельных апдейтах рисуем по одному
+_PLOT_LOCK = threading.Lock()
+
+# Больше точек на графике 6.4×3.2 дюйма всё равно не различить
+MAX_PLOT_POINTS = 150
+
+# Числа дат matplotlib — дни от его эпохи (1970-01-01): ordinal → число без объектов datetime
+_EPOCH_ORDINAL = datetime.fromisoformat(mdates.get_epoch()).toordinal()
 
 def parse_date_range(arg: str, default_days=7) -> tuple[datetime, datetime] | None:
-    arg = arg.strip()
+    """Период из аргумента /predict; None — не разобран или такой даты нет (31.02)."""
+    try:
+        return _parse_date_range(arg.strip())
+    except ValueError:
+        return None
+
+
+def _parse_date_range(arg: str) -> tuple[datetime, datetime] | None:
     if arg.isdigit():
         n = max(1, int(arg))
         end = datetime.now()
@@ -16,7 +35,22 @@ def parse_date_range(arg: str, default_days=7) -> tuple[datetime, datetime] | No
         start = end - timedelta(days=n * 2 + 5)
         return start, end
 
-    # 2. Диапазон: DD.MM–DD.MM или DD.MM-DD.MM
+    # 2. Диапазон с годами: DD.MM.YYYY–DD.MM.YYYY
+    match = re.match(
+        r"(\d{1,2})\.(\d{1,2})\.(\d{4})\s*[-–]\s*(\d{1,2})\.(\d{1,2})\.(\d{4})$", arg
+    )
+    if match:
+        d1, m1, y1, d2, m2, y2 = map(int, match.groups())
+        start, end = datetime(y1, m1, d1), datetime(y2, m2, d2)
+        return (start, end) if start <= end else (end, start)
+
+    # 3. Диапазон лет: YYYY–YYYY (с 1 января по 31 декабря, но не позже сегодня)
+    match = re.match(r"(\d{4})\s*[-–]\s*(\d{4})$", arg)
+    if match:
+        y1, y2 = sorted(map(int, match.groups()))
+        return datetime(y1, 1, 1), min(datetime(y2, 12, 31), datetime.now())
+
+    # 4. Диапазон: DD.MM–DD.MM или DD.MM-DD.MM
     match = re.match(r"(\d{1,2})\.(\d{1,2})\s*[-–]\s*(\d{1,2})\.(\d{1,2})", arg)
     if match:
         d1, m1, d2, m2 = map(int, match.groups())
@@ -29,14 +63,49 @@ def parse_date_range(arg: str, default_days=7) -> tuple[datetime, datetime] | No
 
     return None
 
+
+def lttb(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """Largest-Triangle-Three-Buckets: индексы n_out точек, сохраняющих форму ряда.
+
+    В отличие от прореживания с шагом, из каждой корзины берётся точка, дающая
+    наибольший треугольник с соседями, поэтому пики и провалы не теряются.
+    Первая и последняя точки сохраняются всегда.
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    # Границы n_out - 2 корзин по внутренним точкам 1..n-2
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    idx = np.empty(n_out, dtype=np.int64)
+    idx[0], idx[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        # Третья вершина — среднее следующей корзины (для последней — последняя точка)
+        if i + 2 < len(edges):
+            nlo, nhi = edges[i + 1], edges[i + 2]
+            cx, cy = x[nlo:nhi].mean(), y[nlo:nhi].mean()
+        else:
+            cx, cy = x[-1], y[-1]
+        area = np.abs(
+            (x[a] - cx) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (cy - y[a])
+        )
+        a = lo + int(area.argmax())
+        idx[i + 1] = a
+    return idx
+
+
 def plot_trend(currency: str, date_arg: str = "7") -> bytes | None:
     dr = parse_date_range(date_arg)
     if not dr:
         return None
 
     start, end = dr
-    all_data = get_rates_range(start, end, currency)
-    if len(all_data) < 2:
+    series = get_series(start, end, currency)
+    if len(series) < 2:
         return None
 
     # Если запросили N дней — берём последние N точек
@@ -44,47 +113,71 @@ def plot_trend(currency: str, date_arg: str = "7") -> bytes | None:
     if date_arg.isdigit():
         n_requested = int(date_arg)
         if n_requested > 0:
-            all_data = all_data[-n_requested:]  # последние N записей
+            series = series[-n_requested:]  # последние N записей (view)
 
-    if len(all_data) < 2:
+    if len(series) < 2:
         return None
 
-    # Ограничиваем максимум
-    if len(all_data) > 30:
-        step = len(all_data) // 30
-        all_data = all_data[::step] or all_data[:30]
+    x = (series.days - _EPOCH_ORDINAL).astype(np.float64)
+    y = series.rates
 
-    dates = [d.strftime("%d.%m") for d, _ in all_data]
-    rates = [r for _, r in all_data]
+    # Прогноз — только если запрашивали N дней И ≥2 точки (по исходному ряду)
+    pred = None
+    if n_requested is not None:
+        next_day = series.date(-1) + timedelta(days=1)
+        while next_day.weekday() >= 5:
+            next_day += timedelta(days=1)
+        pred = (float(next_day.toordinal() - _EPOCH_ORDINAL), y[-1] + (y[-1] - y[-2]))
 
-    # Прогноз — только если запрашивали N дней И ≥2 точки
-    show_pred = n_requested is not None and len(rates) >= 2
-    pred_rate = None
-    if show_pred:
-        delta = rates[-1] - rates[-2]
-        pred_rate = rates[-1] + delta
-        dates.append("→")
-        rates.append(pred_rate)
+    # Длинные периоды: сохраняем форму ряда (LTTB), а не каждую k-ю точку
+    span_days = x[-1] - x[0]
+    if len(x) > MAX_PLOT_POINTS:
+        keep = lttb(x, y, MAX_PLOT_POINTS)
+        x, y = x[keep], y[keep]
+    if pred is not None:
+        x, y = np.append(x, pred[0]), np.append(y, pred[1])
 
     # Построение
+    with _PLOT_LOCK:
+        return _render(x, y, span_days, currency, pred)
+
+
+def chart_key(currency: str, date_arg: str = "7") -> str | None:
+    """Ключ графика для кэша file_id: тот же символ, период и последний курс → та же картинка."""
+    dr = parse_date_range(date_arg)
+    if not dr:
+        return None
+    data = get_series(dr[0], dr[1], currency)
+    if len(data) < 2:
+        return None
+    return f"{symbol_name(currency)}|{date_arg}|{data.date(-1):%Y-%m-%d}|{len(data)}"
+
+
+def _render(x, y, span_days, currency, pred) -> bytes:
     plt.figure(figsize=(6.4, 3.2), dpi=120)
-    plt.plot(dates, rates, marker='o', linewidth=1.1, markersize=3, color='black')
+    markersize = 3 if len(x) <= 40 else 0
+    plt.plot(x, y, marker='o', linewidth=1.1, markersize=markersize, color='black')
+
+    if pred is not None:
+        plt.plot([pred[0]], [pred[1]], marker='x', color='black', markersize=6)
 
-    if pred_rate is not None:
-        plt.plot(["→"], [pred_rate], marker='x', color='black', markersize=6)
+    ax = plt.gca()
+    ax.xaxis.set_major_locator(mdates.AutoDateLocator(minticks=4, maxticks=10))
+    ax.xaxis.set_major_formatter(mdates.DateFormatter("%d.%m" if span_days <= 366 else "%m.%Y"))
 
-    plt.title(f"{currency}/RUB", fontsize=10, pad=8)
+    base, quote = parse_symbol(currency)
+    plt.title(f"{base}/{quote}", fontsize=10, pad=8)
     plt.xlabel("Дата", fontsize=8, labelpad=4)
-    plt.ylabel("Курс, руб.", fontsize=8, labelpad=4)
+    plt.ylabel("Курс, руб." if quote == "RUB" else f"Курс, {quote}", fontsize=8, labelpad=4)
     plt.xticks(fontsize=7, rotation=35)
     plt.yticks(fontsize=7)
     plt.tight_layout(pad=1.5)
     plt.grid(False)
     for spine in ['top', 'right']:
-        plt.gca().spines[spine].set_visible(False)
+        ax.spines[spine].set_visible(False)
 
     buf = io.BytesIO()
     plt.savefig(buf, format='png', bbox_inches='tight')
     plt.close()
     buf.seek(0)
-    return buf.read()
\ No newline at end of file
+    return buf.read()
@@ -0,0 +1,192 @@
+# v3_ml_model/profiling.py
+"""Профилирование по запросу: cProfile + tracemalloc для обработчиков бота и стадий train.py.
+
+Включается одним из способов:
+    PROFILE=1            каждый вызов (или `python train.py --profile`)
+    PROFILE_SAMPLE=100   каждый 100-й вызов обработчика
+    /profile 5           админ (BOT_ADMINS) — следующие 5 вызовов
+
+Отчёты пишутся в PROFILE_DIR: <время>_<имя>.prof (pstats: `python -m pstats`, snakeviz)
+и .txt — топ функций по cumulative и топ аллокаций tracemalloc. Пока профилирование
+выключено, обёртка стоит одну проверку флагов на вызов.
+"""
+import asyncio
+import contextvars
+import cProfile
+import functools
+import io
+import itertools
+import logging
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = Path(os.getenv("PROFILE_DIR", "profiles"))
+PROFILE_ALWAYS = os.getenv("PROFILE", "") == "1"
+PROFILE_SAMPLE = int(os.getenv("PROFILE_SAMPLE", "0"))  # 0 — без выборки
+PROFILE_TOP = int(os.getenv("PROFILE_TOP", "25"))
+
+_armed = 0  # сколько следующих вызовов профилировать (команда /profile)
+_calls = itertools.count(1)
+_lock = threading.Lock()
+_tracing = 0  # активных сессий: tracemalloc включён, пока есть хоть одна
+_own_tracing = False  # tracemalloc включили мы (а не PYTHONTRACEMALLOC) — нам и выключать
+_current = contextvars.ContextVar("profile_session", default=None)
+
+
+def arm(n: int) -> None:
+    global _armed
+    with _lock:
+        _armed = max(0, n)
+
+
+def status() -> dict:
+    return {"always": PROFILE_ALWAYS, "sample": PROFILE_SAMPLE, "armed": _armed}
+
+
+def _should_profile() -> bool:
+    global _armed
+    if PROFILE_ALWAYS:
+        return True
+    if PROFILE_SAMPLE and next(_calls) % PROFILE_SAMPLE == 0:
+        return True
+    with _lock:
+        if _armed:
+            _armed -= 1
+            return True
+    return False
+
+
+class _Session:
+    """Профиль одного запроса/стадии: cProfile из всех потоков, где шла работа, + разница аллокаций."""
+
+    def __init__(self, name: str):
+        global _tracing, _own_tracing
+        self.name = name
+        self.stats = None
+        self.busy = 0  # участков без cProfile — профилировщик был занят другим потоком
+        self._stats_lock = threading.Lock()
+        with _lock:
+            if _tracing == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                _own_tracing = True
+            _tracing += 1
+        tracemalloc.reset_peak()
+        self._before = tracemalloc.take_snapshot()
+        self._t0 = time.perf_counter()
+
+    def start(self) -> cProfile.Profile | None:
+        """Профилировщик для текущего потока; None, если он уже занят (Python 3.12+: один на процесс)."""
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            self.busy += 1
+            return None
+        return profiler
+
+    def stop(self, profiler: cProfile.Profile | None) -> None:
+        if profiler is None:
+            return
+        profiler.disable()
+        with self._stats_lock:
+            if self.stats is None:
+                self.stats = pstats.Stats(profiler)
+            else:
+                self.stats.add(profiler)
+
+    def run(self, func, *args, **kwargs):
+        profiler = self.start()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.stop(profiler)
+
+    def finish(self) -> Path:
+        global _tracing, _own_tracing
+        wall = time.perf_counter() - self._t0
+        after = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        with _lock:
+            _tracing -= 1
+            if _tracing == 0 and _own_tracing:
+                tracemalloc.stop()
+                _own_tracing = False
+
+        own = tuple(tracemalloc.Filter(False, mod.__file__) for mod in (tracemalloc, pstats, cProfile)) + (
+            tracemalloc.Filter(False, __file__),
+        )
+        diff = after.filter_traces(own).compare_to(self._before.filter_traces(own), "lineno")
+        grown = sum(d.size_diff for d in diff)
+
+        PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+        base = PROFILE_DIR / f"{datetime.now():%Y%m%d_%H%M%S_%f}_{self.name}"
+        out = io.StringIO()
+        out.write(f"{self.name}: {wall:.3f} с, память +{grown / 1024:.1f} КБ, пик {peak / 1024:.1f} КБ\n")
+        if self.busy:
+            out.write(f"(без cProfile: {self.busy} участков — профилировщик был занят)\n")
+        if self.stats is not None:
+            self.stats.dump_stats(f"{base}.prof")
+            out.write(f"\n=== cProfile: топ-{PROFILE_TOP} по cumulative ===\n")
+            self.stats.stream = out
+            self.stats.sort_stats("cumulative").print_stats(PROFILE_TOP)
+        out.write(f"\n=== tracemalloc: топ-{PROFILE_TOP} строк по приросту памяти ===\n")
+        for stat in diff[:PROFILE_TOP]:
+            out.write(f"{stat}\n")
+        Path(f"{base}.txt").write_text(out.getvalue(), encoding="utf-8")
+        logger.info(f"🔬 Профиль {self.name}: {wall:.3f} с → {base}.txt")
+        return Path(f"{base}.txt")
+
+
+def profiled(name: str | None = None):
+    """Декоратор async-обработчика: при срабатывании профилирует его блокирующую работу (to_thread)."""
+    def decorator(handler):
+        label = name or handler.__name__
+
+        @functools.wraps(handler)
+        async def wrapper(*args, **kwargs):
+            if not (PROFILE_ALWAYS or PROFILE_SAMPLE or _armed) or not _should_profile():
+                return await handler(*args, **kwargs)
+            session = await asyncio.to_thread(_Session, label)
+            token = _current.set(session)
+            try:
+                return await handler(*args, **kwargs)
+            finally:
+                _current.reset(token)
+                await asyncio.to_thread(session.finish)
+        return wrapper
+    return decorator
+
+
+async def to_thread(func, *args, **kwargs):
+    """asyncio.to_thread; внутри профилируемого запроса работа в потоке попадает в его профиль.
+
+    cProfile видит только свой поток, а тяжёлая часть обработчиков (данные, модель,
+    графики) идёт в пуле потоков — поэтому профилируется именно она.
+    """
+    session = _current.get()
+    if session is None:
+        return await asyncio.to_thread(func, *args, **kwargs)
+    return await asyncio.to_thread(session.run, func, *args, **kwargs)
+
+
+@contextmanager
+def profile_block(name: str):
+    """Синхронный участок (стадия train.py) целиком в текущем потоке."""
+    if not (PROFILE_ALWAYS or PROFILE_SAMPLE or _armed) or not _should_profile():
+        yield
+        return
+    session = _Session(name)
+    profiler = session.start()
+    try:
+        yield
+    finally:
+        session.stop(profiler)
+        session.finish()
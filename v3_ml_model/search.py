@@ -0,0 +1,198 @@
+# v3_ml_model/search.py
+"""Подбор гиперпараметров леса и калибровки: `python train.py search`.
+
+Признаки считаются один раз (свой набор search_data/ из train.py), фолды — по времени,
+каждая пара (конфигурация, фолд) считается в пуле процессов и сохраняется на диск,
+так что прерванный поиск продолжается с места остановки.
+"""
+import csv
+import hashlib
+import itertools
+import json
+import logging
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import numpy as np
+from sklearn.calibration import CalibratedClassifierCV
+from sklearn.metrics import accuracy_score, brier_score_loss
+from sklearn.model_selection import TimeSeriesSplit
+from dataset import open_dataset, row_blocks
+
+logger = logging.getLogger(__name__)
+
+SEARCH_DIR = Path("search_cache")
+LEADERBOARD_PATH = "search_leaderboard.csv"
+
+SEARCH_SPACE = {
+    "n_estimators": [50, 100, 200],
+    "max_depth": [4, 6, 8, 12],
+    "min_samples_split": [2, 5, 10],
+    "min_samples_leaf": [1, 5, 20],
+    "max_features": ["sqrt", None],
+    "calibration": ["isotonic", "sigmoid"],
+    "calibration_cv": [3, 5],
+}
+
+# Текущие параметры train.py — всегда попадают в поиск как точка отсчёта
+BASELINE = {
+    "n_estimators": 100,
+    "max_depth": 6,
+    "min_samples_split": 5,
+    "min_samples_leaf": 1,
+    "max_features": "sqrt",
+    "calibration": "isotonic",
+    "calibration_cv": 3,
+}
+
+_DATA = None
+
+
+def config_key(config: dict) -> str:
+    return hashlib.sha1(json.dumps(config, sort_keys=True).encode()).hexdigest()[:12]
+
+
+def data_fingerprint(X: np.ndarray, y: np.ndarray) -> str:
+    # Блоками — набор может не помещаться в память
+    h = hashlib.sha1()
+    for i, j in row_blocks(0, len(y)):
+        h.update(np.ascontiguousarray(X[i:j]).tobytes())
+        h.update(np.ascontiguousarray(y[i:j]).tobytes())
+    return h.hexdigest()[:12]
+
+
+def candidate_configs(n_iter: int | None, seed: int = 42) -> list[dict]:
+    """Полная сетка (n_iter=None) или n_iter случайных точек из неё + базовая конфигурация."""
+    names = list(SEARCH_SPACE)
+    grid = [dict(zip(names, values)) for values in itertools.product(*SEARCH_SPACE.values())]
+    if n_iter is not None and n_iter < len(grid):
+        grid = random.Random(seed).sample(grid, n_iter)
+    if BASELINE not in grid:
+        grid.insert(0, dict(BASELINE))
+    return grid
+
+
+def time_folds(days: np.ndarray, n_folds: int) -> list[tuple[np.ndarray, np.ndarray]]:
+    """Фолды TimeSeriesSplit по уникальным датам: один день целиком в train или в test."""
+    unique_days = np.unique(days)
+    folds = []
+    for train_d, test_d in TimeSeriesSplit(n_splits=n_folds).split(unique_days):
+        train_idx = np.flatnonzero(days <= unique_days[train_d[-1]])
+        test_idx = np.flatnonzero(np.isin(days, unique_days[test_d]))
+        folds.append((train_idx, test_idx))
+    return folds
+
+
+def _init_worker(data_path: str) -> None:
+    # memmap: процессы пула делят страницы набора через кэш ОС, а не копируют его
+    global _DATA
+    _DATA, _ = open_dataset(data_path)
+
+
+def _evaluate(config: dict, train_idx: np.ndarray, test_idx: np.ndarray) -> dict:
+    from train import make_forest
+
+    X, y = _DATA["X"], _DATA["y"]
+    params = {k: v for k, v in config.items() if not k.startswith("calibration")}
+    model = CalibratedClassifierCV(
+        make_forest(n_jobs=1, **params),
+        method=config["calibration"],
+        cv=config["calibration_cv"],
+    )
+    t0 = time.perf_counter()
+    model.fit(X[train_idx], y[train_idx])
+    fit_s = time.perf_counter() - t0
+
+    proba = model.predict_proba(X[test_idx])[:, 1]
+    # Задержка как в боте: predict_proba на одной строке
+    row = X[test_idx[-1:]]
+    timings = []
+    for _ in range(20):
+        t0 = time.perf_counter()
+        model.predict_proba(row)
+        timings.append(time.perf_counter() - t0)
+
+    return {
+        "accuracy": float(accuracy_score(y[test_idx], proba > 0.5)),
+        "brier": float(brier_score_loss(y[test_idx], proba)),
+        "latency_ms": float(np.median(timings) * 1000),
+        "fit_s": fit_s,
+    }
+
+
+def _run_task(config: dict, fold: int, train_idx, test_idx, result_path: str) -> dict:
+    result = _evaluate(config, train_idx, test_idx)
+    tmp = f"{result_path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"config": config, "fold": fold, **result}, f)
+    os.replace(tmp, result_path)
+    return result
+
+
+def leaderboard(configs: list[dict], cache_dir: Path, n_folds: int) -> list[dict]:
+    rows = []
+    for config in configs:
+        results = []
+        for fold in range(n_folds):
+            path = cache_dir / f"{config_key(config)}_f{fold}.json"
+            if path.exists():
+                results.append(json.loads(path.read_text(encoding="utf-8")))
+        if len(results) < n_folds:
+            continue
+        rows.append({
+            **config,
+            "accuracy": float(np.mean([r["accuracy"] for r in results])),
+            "brier": float(np.mean([r["brier"] for r in results])),
+            "latency_ms": float(np.mean([r["latency_ms"] for r in results])),
+            "fit_s": float(np.mean([r["fit_s"] for r in results])),
+            "baseline": config == BASELINE,
+        })
+    rows.sort(key=lambda r: (r["brier"], -r["accuracy"]))
+    return rows
+
+
+def run_search(data_path: str, n_iter: int | None = 30, n_folds: int = 4, jobs: int | None = None, top: int = 15):
+    ds, _ = open_dataset(data_path)
+    X, y, days = ds["X"], ds["y"], ds["day"]
+    # Кэш фолдов привязан к набору данных и к разбиению: новые данные или другое число
+    # фолдов (другие границы time_folds) — новые результаты
+    cache_dir = SEARCH_DIR / data_fingerprint(X, y) / f"folds{n_folds}"
+    cache_dir.mkdir(parents=True, exist_ok=True)
+
+    configs = candidate_configs(n_iter)
+    folds = time_folds(days, n_folds)
+    tasks = [
+        (config, fold, train_idx, test_idx, str(cache_dir / f"{config_key(config)}_f{fold}.json"))
+        for config in configs
+        for fold, (train_idx, test_idx) in enumerate(folds)
+    ]
+    todo = [t for t in tasks if not os.path.exists(t[-1])]
+    logger.info(
+        f"🔎 {len(configs)} конфигураций × {n_folds} фолдов: "
+        f"{len(tasks) - len(todo)} уже посчитано, осталось {len(todo)}"
+    )
+
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(data_path,)) as pool:
+        futures = [pool.submit(_run_task, *task) for task in todo]
+        for done, future in enumerate(as_completed(futures), 1):
+            future.result()
+            if done % 10 == 0 or done == len(futures):
+                logger.info(f"   {done}/{len(futures)}")
+
+    rows = leaderboard(configs, cache_dir, n_folds)
+    if rows:
+        with open(LEADERBOARD_PATH, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+
+    print(f"\n{'#':>3} {'точность':>9} {'Brier':>7} {'мс/прогноз':>11} {'обуч., с':>9}  параметры")
+    for i, r in enumerate(rows[:top], 1):
+        params = ", ".join(f"{k}={r[k]}" for k in SEARCH_SPACE)
+        mark = " ← текущие" if r["baseline"] else ""
+        print(f"{i:>3} {r['accuracy']:>9.2%} {r['brier']:>7.4f} {r['latency_ms']:>11.2f} {r['fit_s']:>9.1f}  {params}{mark}")
+    logger.info(f"💾 Полная таблица: {LEADERBOARD_PATH}")
+    return rows
@@ -0,0 +1,68 @@
+# v3_ml_model/series.py
+"""Ряд курсов одной валюты (или пары): два параллельных массива вместо списка (datetime, курс).
+
+    days   int32   дата (date.toordinal()), по возрастанию
+    rates  float64 курс
+
+Срезы, окна и поля — представления (view) тех же массивов, без копирования и без
+объекта datetime на каждую точку; datetime создаётся только по запросу (date()).
+"""
+from datetime import datetime
+from itertools import chain
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from indicators import pct_change
+
+
+class RateSeries:
+    __slots__ = ("days", "rates")
+
+    def __init__(self, days, rates):
+        self.days = np.asarray(days, dtype=np.int32)
+        self.rates = np.asarray(rates, dtype=np.float64)
+        if self.days.shape != self.rates.shape or self.days.ndim != 1:
+            raise ValueError("days и rates должны быть одномерными и одной длины")
+
+    @classmethod
+    def empty(cls) -> "RateSeries":
+        return cls(np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float64))
+
+    @classmethod
+    def from_rows(cls, rows) -> "RateSeries":
+        """Из строк (день, курс), напр. курсора storage.get_rates: строки по одной, без списка кортежей."""
+        flat = np.fromiter(chain.from_iterable(rows), dtype=np.float64).reshape(-1, 2)
+        return cls(flat[:, 0], flat[:, 1].copy())
+
+    def __len__(self) -> int:
+        return len(self.days)
+
+    def __getitem__(self, item) -> "RateSeries":
+        """Срез ряда (view); для одной точки — date(i) и rates[i]."""
+        if not isinstance(item, slice):
+            raise TypeError("RateSeries поддерживает только срезы; точка — date(i), rates[i]")
+        return RateSeries(self.days[item], self.rates[item])
+
+    def __repr__(self) -> str:
+        if not len(self):
+            return "RateSeries([])"
+        return f"RateSeries({len(self)} точек, {self.date(0):%d.%m.%Y}–{self.date(-1):%d.%m.%Y})"
+
+    def date(self, i: int) -> datetime:
+        return datetime.fromordinal(int(self.days[i]))
+
+    def pct_change(self) -> np.ndarray:
+        """Относительное изменение к предыдущей точке; первое значение — NaN."""
+        return pct_change(self.rates)
+
+    def rolling(self, window: int) -> np.ndarray:
+        """Окна курсов длиной window: массив (len − window + 1) × window — view, без копии."""
+        if len(self) < window:
+            return np.empty((0, window), dtype=np.float64)
+        return sliding_window_view(self.rates, window)
+
+    def align(self, other: "RateSeries") -> tuple["RateSeries", "RateSeries"]:
+        """Оба ряда на общих датах (для кросс-курсов)."""
+        _, i, j = np.intersect1d(self.days, other.days, assume_unique=True, return_indices=True)
+        return RateSeries(self.days[i], self.rates[i]), RateSeries(other.days[j], other.rates[j])
@@ -0,0 +1,230 @@
+# v3_ml_model/storage.py
+"""Общее хранилище на SQLite: курсы, справочник валют, готовые прогнозы и file_id графиков.
+
+Один файл БД обслуживает несколько процессов на хосте (реплики бота, train.py):
+режим WAL даёт читателям согласованный снимок, не блокируя писателя, а запись идёт
+короткими пакетными транзакциями (executemany). Курсы читаются по ключу (валюта, день).
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+DB_PATH = Path(os.getenv("BOT_DB", "cache/bot.sqlite3"))
+BUSY_TIMEOUT = 30.0  # секунд ждать освобождения блокировки записи другим процессом
+
+# Сколько хранить готовые прогнозы и file_id графиков
+PREDICTION_KEEP_DAYS = 30
+CHART_KEEP_SECONDS = 7 * 24 * 3600
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rates (
+    currency TEXT NOT NULL,
+    day INTEGER NOT NULL,  -- date.toordinal()
+    rate REAL NOT NULL,  -- рублей за 1 единицу валюты
+    PRIMARY KEY (currency, day)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS rates_day ON rates (day);
+
+-- Дни, загруженные из XML_daily целиком (все валюты); остальные дни — частичные
+CREATE TABLE IF NOT EXISTS days (
+    day INTEGER PRIMARY KEY,
+    fetched REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS currencies (
+    code TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    cbr_id TEXT,
+    pos INTEGER NOT NULL  -- порядок как в XML ЦБ
+);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS predictions (
+    symbol TEXT NOT NULL,
+    day INTEGER NOT NULL,  -- дата последнего курса, по которому сделан прогноз
+    model TEXT NOT NULL,  -- версия model_all.pkl
+    payload TEXT NOT NULL,
+    PRIMARY KEY (symbol, day, model)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS charts (
+    key TEXT PRIMARY KEY,
+    file_id TEXT NOT NULL,
+    created REAL NOT NULL
+);
+"""
+
+# По соединению на поток: sqlite3.Connection нельзя делить между потоками
+_local = threading.local()
+
+
+def connect() -> sqlite3.Connection:
+    path = str(DB_PATH)
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.path != path:
+        DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+        # isolation_level=None — транзакции открываются явно в transaction()
+        conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")  # в WAL это всё ещё устойчиво к сбою процесса
+        conn.executescript(_SCHEMA)
+        _local.conn, _local.path = conn, path
+    return conn
+
+
+@contextmanager
+def transaction():
+    """Транзакция записи; BEGIN IMMEDIATE сразу берёт блокировку, без гонки «чтение → запись»."""
+    conn = connect()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+# === Курсы ===
+def put_rates(rows, complete_days=()) -> None:
+    """Пакет курсов (валюта, день, курс) одной транзакцией; complete_days — дни, загруженные целиком."""
+    now = time.time()
+    with transaction() as conn:
+        conn.executemany("INSERT OR REPLACE INTO rates (currency, day, rate) VALUES (?, ?, ?)", rows)
+        conn.executemany(
+            "INSERT OR REPLACE INTO days (day, fetched) VALUES (?, ?)",
+            ((day, now) for day in complete_days),
+        )
+
+
+def put_rates_bulk(batches) -> tuple[int, int]:
+    """Итератор пакетов (строки курсов, полные дни) — одной транзакцией. → (строк, дней).
+
+    Пакеты пишутся по мере поступления, так что весь объём в памяти не держится.
+    """
+    now = time.time()
+    n_rows = n_days = 0
+    with transaction() as conn:
+        for rows, complete_days in batches:
+            conn.executemany("INSERT OR REPLACE INTO rates (currency, day, rate) VALUES (?, ?, ?)", rows)
+            conn.executemany(
+                "INSERT OR REPLACE INTO days (day, fetched) VALUES (?, ?)", ((day, now) for day in complete_days)
+            )
+            n_rows += len(rows)
+            n_days += len(complete_days)
+    return n_rows, n_days
+
+
+def get_rate(currency: str, day: int) -> float | None:
+    row = connect().execute(
+        "SELECT rate FROM rates WHERE currency = ? AND day = ?", (currency, day)
+    ).fetchone()
+    return row[0] if row else None
+
+
+def get_rates(currency: str, first_day: int, last_day: int):
+    """Итератор (день, курс) валюты за период по возрастанию дат — один проход по первичному ключу.
+
+    Курсор, а не список: RateSeries.from_rows читает строки в массив, не держа их все разом.
+    """
+    return connect().execute(
+        "SELECT day, rate FROM rates WHERE currency = ? AND day BETWEEN ? AND ? ORDER BY day",
+        (currency, first_day, last_day),
+    )
+
+
+def complete_days(first_day: int, last_day: int) -> set[int]:
+    rows = connect().execute(
+        "SELECT day FROM days WHERE day BETWEEN ? AND ?", (first_day, last_day)
+    ).fetchall()
+    return {day for (day,) in rows}
+
+
+def get_complete_rows(first_day: int, last_day: int) -> list[tuple[int, str, float]]:
+    """(день, валюта, курс) всех полностью загруженных дней периода."""
+    return connect().execute(
+        "SELECT r.day, r.currency, r.rate FROM rates r JOIN days d ON d.day = r.day "
+        "WHERE r.day BETWEEN ? AND ? ORDER BY r.day",
+        (first_day, last_day),
+    ).fetchall()
+
+
+# === Справочник валют ===
+def put_catalog(rows, updated: float | None = None) -> None:
+    """Справочник целиком: [(код, название, Valute ID)] в порядке ЦБ.
+
+    updated — время актуальности; 0 — устаревший (бот перечитает его из ЦБ при первой возможности).
+    """
+    with transaction() as conn:
+        conn.execute("DELETE FROM currencies")
+        conn.executemany(
+            "INSERT INTO currencies (code, name, cbr_id, pos) VALUES (?, ?, ?, ?)",
+            ((code, name, cbr_id, pos) for pos, (code, name, cbr_id) in enumerate(rows)),
+        )
+        conn.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES ('catalog_updated', ?)",
+            (str(time.time() if updated is None else updated),),
+        )
+
+
+def get_catalog(max_age: float | None = None) -> dict[str, str] | None:
+    """{код: название}; None, если справочника нет или он старше max_age секунд."""
+    conn = connect()
+    if max_age is not None:
+        row = conn.execute("SELECT value FROM meta WHERE key = 'catalog_updated'").fetchone()
+        if not row or time.time() - float(row[0]) > max_age:
+            return None
+    rows = conn.execute("SELECT code, name FROM currencies ORDER BY pos").fetchall()
+    return dict(rows) or None
+
+
+def get_currency_ids() -> dict[str, str]:
+    """{код: Valute ID} всех валют справочника."""
+    return dict(connect().execute("SELECT code, cbr_id FROM currencies WHERE cbr_id IS NOT NULL").fetchall())
+
+
+def get_currency_id(code: str) -> str | None:
+    row = connect().execute("SELECT cbr_id FROM currencies WHERE code = ?", (code,)).fetchone()
+    return row[0] if row else None
+
+
+# === Готовые прогнозы и графики ===
+def get_prediction(symbol: str, day: int, model: str) -> dict | None:
+    row = connect().execute(
+        "SELECT payload FROM predictions WHERE symbol = ? AND day = ? AND model = ?", (symbol, day, model)
+    ).fetchone()
+    return json.loads(row[0]) if row else None
+
+
+def put_prediction(symbol: str, day: int, model: str, payload: dict) -> None:
+    with transaction() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO predictions (symbol, day, model, payload) VALUES (?, ?, ?, ?)",
+            (symbol, day, model, json.dumps(payload, ensure_ascii=False)),
+        )
+        conn.execute("DELETE FROM predictions WHERE day < ?", (day - PREDICTION_KEEP_DAYS,))
+
+
+def get_chart(key: str) -> str | None:
+    row = connect().execute("SELECT file_id FROM charts WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+
+def put_chart(key: str, file_id: str) -> None:
+    now = time.time()
+    with transaction() as conn:
+        conn.execute("INSERT OR REPLACE INTO charts (key, file_id, created) VALUES (?, ?, ?)", (key, file_id, now))
+        conn.execute("DELETE FROM charts WHERE created < ?", (now - CHART_KEEP_SECONDS,))
+
+
+def drop_chart(key: str) -> None:
+    with transaction() as conn:
+        conn.execute("DELETE FROM charts WHERE key = ?", (key,))
@@ -1,67 +1,109 @@
+import argparse
+import json
+import os
+import resource
+import time
 import joblib
 import numpy as np
 import logging
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.calibration import CalibratedClassifierCV
+from sklearn.frozen import FrozenEstimator
 from sklearn.metrics import classification_report, accuracy_score, brier_score_loss
 from sklearn.utils.class_weight import compute_class_weight
 from data_loader import get_all_currencies, get_rates_range
-from feature_engineer import compute_features
+from dataset import DatasetWriter, load_rows, open_dataset, prefix_fingerprint, read_meta, row_blocks
+from feature_engineer import feature_rows
+from indicators import DEFAULT_SPEC, feature_names, history_days, validate_spec
+from model import precompute_predictions
+from series import RateSeries
+import profiling
 
 logging.basicConfig(
     format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO
 )
 logger = logging.getLogger(__name__)
 
+MODEL_PATH = "model_all.pkl"
+DATA_PATH = "train_data"  # все размеченные строки на диске (dataset.py): признаки, метка, дата, валюта
+STATE_PATH = "train_state.joblib"  # лес для дообучения, сколько строк он видел и к какому набору они относятся
+SEARCH_DATA_PATH = "search_data"  # отдельный набор поиска: train_data/ и STATE_PATH он не трогает
+FEATURE_WINDOW = 5
 
-def collect_data_for_currency(currency: str, days_back: int = 1000):
+# === Потоковая сборка набора ===
+DAYS_BACK = 1000
+CHUNK_DAYS = 365  # признаки считаются по чанкам: все валюты за год, затем следующий год
+TRAIN_ROWS = 2_000_000  # сколько строк обучения держим в памяти; больше — случайная выборка
+
+# === Инкрементальное дообучение ===
+CALIB_ROWS = 2000  # последние строки — только для калибровки isotonic (≈50 дней × 40 валют)
+CALIB_MIN_ROWS = 400  # меньше строк, не виденных лесом, — калибровка не обновляется
+GROW_MIN_ROWS = 400  # столько новых строк нужно, чтобы дорастить деревья (≈10 дней)
+ROLLING_ROWS = 8000  # окно, на котором растут новые деревья
+TREES_PER_GROWTH = 10
+MAX_TREES = 100  # старейшие деревья отбрасываются — скользящий лес
+
+
+def collect_data_for_currency(currency: str, days_back: int = DAYS_BACK) -> RateSeries:
     end = datetime.now()
     start = end - timedelta(days=days_back)
     return get_rates_range(start, end, currency)
 
 
-def main():
-    currencies = list(get_all_currencies().keys())
-    logger.info(f"Начало сбора данных для {len(currencies)} валют")
-
-    X_all, y_all = [], []
-    stats = {}
-
-    for curr in currencies:
-        logger.info(f"→ {curr}...")
-        data = collect_data_for_currency(curr)
-        if len(data) < 10:
-            stats[curr] = 0
-            continue
-
-        X, y = compute_features(data, window=5)
-        if len(X) == 0:
-            stats[curr] = 0
-            continue
-
-        X_all.extend(X)
-        y_all.extend(y)
-        stats[curr] = len(X)
-        logger.info(f"   +{len(X)} примеров")
-
-    X_all = np.array(X_all)
-    y_all = np.array(y_all)
-    total = len(X_all)
-    logger.info(f"\n📊 Всего собрано: {total} примеров")
+# === Память по стадиям ===
+STAGES = []
 
-    if total < 50:
-        logger.error("❌ Недостаточно данных. Соберите минимум 50 записей.")
-        return
 
-    # Разделение без перемешивания
-    split_idx = int(0.8 * total)
-    X_train, X_test = X_all[:split_idx], X_all[split_idx:]
-    y_train, y_test = y_all[:split_idx], y_all[split_idx:]
+def _status_mb(field: str) -> float | None:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def _reset_peak_rss() -> bool:
+    # Linux: «5» в clear_refs сбрасывает VmHWM — пик считается заново для каждой стадии
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
 
-    # 1. Базовая модель с балансировкой классов
-    logger.info("Обучение RandomForest с class_weight='balanced'...")
-    base_model = RandomForestClassifier(
+
+@contextmanager
+def stage(name: str):
+    """Время и пиковый RSS стадии; итог — log_stages(). С --profile / PROFILE=1 — ещё и профиль."""
+    per_stage = _reset_peak_rss()
+    t0 = time.perf_counter()
+    with profiling.profile_block(f"train_{name.replace(' ', '_')}"):
+        yield
+    peak = _status_mb("VmHWM") or resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    STAGES.append({"stage": name, "seconds": time.perf_counter() - t0, "peak_rss_mb": peak, "exact": per_stage})
+    note = "" if per_stage else " (с начала процесса)"
+    logger.info(f"⏱ {name}: {STAGES[-1]['seconds']:.1f} с, пик RSS {peak:.0f} МБ{note}")
+
+
+def log_stages() -> None:
+    for s in STAGES:
+        logger.info(f"   {s['stage']:<14} {s['seconds']:>8.1f} с {s['peak_rss_mb']:>8.0f} МБ")
+
+
+def dump_atomic(obj, path: str) -> None:
+    """joblib.dump через временный файл и os.replace: бот, перечитывающий модель, не увидит недописанный файл."""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    joblib.dump(obj, tmp)
+    os.replace(tmp, path)
+
+
+def make_forest(**params) -> RandomForestClassifier:
+    defaults = dict(
         n_estimators=100,
         max_depth=6,
         min_samples_split=5,
@@ -69,18 +111,119 @@ def main():
         random_state=42,
         n_jobs=-1,
     )
-    base_model.fit(X_train, y_train)
+    defaults.update(params)
+    return RandomForestClassifier(**defaults)
 
-    # 2. Калибровка вероятностей (Isotonic — лучше для небольших данных)
-    logger.info("Калибровка вероятностей (Isotonic Regression)...")
-    calibrated_model = CalibratedClassifierCV(
-        base_model, method="isotonic", cv=3  # 3-fold кросс-валидация внутри калибровки
-    )
-    calibrated_model.fit(X_train, y_train)
 
-    # Оценка
-    y_pred = calibrated_model.predict(X_test)
-    y_proba = calibrated_model.predict_proba(X_test)[:, 1]
+def labeled_rows(series: RateSeries, after_day: int = 0, spec: list[dict] = DEFAULT_SPEC):
+    """Признаки и метки ряда + дата (ordinal) каждой строки; только строки позже `after_day`."""
+    X, y = feature_rows(series.rates, FEATURE_WINDOW, spec)
+    days = series.days[len(series) - len(X):]
+    keep = days > after_day
+    return X[keep], y[keep], days[keep]
+
+
+def _write_block(writer: DatasetWriter, blocks: list[tuple]) -> int:
+    """Блок строк нескольких валют — в набор, отсортированным по дате."""
+    if not blocks:
+        return 0
+    X, y, days, curs = (np.concatenate(col) for col in zip(*blocks))
+    # Сортировка по дате: хвост набора — самые свежие дни по всем валютам
+    order = np.argsort(days, kind="stable")
+    writer.append(X[order], y[order], days[order], curs[order])
+    return len(days)
+
+
+def build_dataset(
+    currencies: list[str],
+    days_back: int = DAYS_BACK,
+    spec: list[dict] = DEFAULT_SPEC,
+    chunk_days: int = CHUNK_DAYS,
+    path: str = DATA_PATH,
+) -> dict:
+    """Потоковая сборка набора в path: чанк по времени × валюта → блок float32 на диск.
+
+    В памяти одновременно только строки одного чанка, так что объём истории
+    (вплоть до всей истории ЦБ) ограничен диском, а не RAM.
+    """
+    end = datetime.now()
+    chunk_start = end - timedelta(days=days_back)
+    # Запас истории перед чанком, чтобы признаки первых строк считались как по всему ряду
+    margin = timedelta(days=history_days(spec, FEATURE_WINDOW))
+    stats = dict.fromkeys(currencies, 0)
+
+    with DatasetWriter(path, spec) as writer:
+        while chunk_start <= end:
+            chunk_end = min(chunk_start + timedelta(days=chunk_days - 1), end)
+            blocks = []
+            for curr in currencies:
+                data = get_rates_range(chunk_start - margin, chunk_end, curr)
+                if len(data) < 10:
+                    continue
+                X, y, days = labeled_rows(data, chunk_start.toordinal() - 1, spec)
+                if len(X):
+                    blocks.append((X.astype(np.float32), y, days, np.full(len(X), curr, dtype="U3")))
+                    stats[curr] += len(X)
+            rows = _write_block(writer, blocks)
+            logger.info(f"→ {chunk_start:%d.%m.%Y}–{chunk_end:%d.%m.%Y}: +{rows} строк ({len(blocks)} валют)")
+            chunk_start = chunk_end + timedelta(days=1)
+
+    return stats
+
+
+def load_spec(path: str | None) -> list[dict]:
+    """Спецификация признаков из JSON-файла: [{"name": "rsi", "period": 14}, ...]."""
+    if not path:
+        return DEFAULT_SPEC
+    with open(path, encoding="utf-8") as f:
+        spec = json.load(f)
+    validate_spec(spec)
+    return spec
+
+
+def main(spec: list[dict] = DEFAULT_SPEC, days_back: int = DAYS_BACK, chunk_days: int = CHUNK_DAYS):
+    currencies = list(get_all_currencies().keys())
+    logger.info(f"Начало сбора данных для {len(currencies)} валют за {days_back} дней")
+    logger.info(f"Признаки: {', '.join(feature_names(spec))}")
+
+    with stage("признаки"):
+        build_dataset(currencies, days_back, spec, chunk_days)
+    ds, meta = open_dataset(DATA_PATH)
+    total = meta["rows"]
+    logger.info(f"\n📊 Всего собрано: {total} примеров")
+
+    if total < 50:
+        logger.error("❌ Недостаточно данных. Соберите минимум 50 записей.")
+        return
+
+    # Разделение без перемешивания (строки отсортированы по дате)
+    split_idx = int(0.8 * total)
+
+    with stage("обучение"):
+        X_train, y_train = load_rows(ds, 0, split_idx, TRAIN_ROWS)
+        if len(y_train) < split_idx:
+            logger.info(f"Обучение на случайной выборке {len(y_train)} из {split_idx} строк")
+
+        # 1. Базовая модель с балансировкой классов
+        logger.info("Обучение RandomForest с class_weight='balanced'...")
+        base_model = make_forest()
+        base_model.fit(X_train, y_train)
+
+        # 2. Калибровка вероятностей (Isotonic — лучше для небольших данных)
+        logger.info("Калибровка вероятностей (Isotonic Regression)...")
+        calibrated_model = CalibratedClassifierCV(
+            base_model, method="isotonic", cv=3  # 3-fold кросс-валидация внутри калибровки
+        )
+        calibrated_model.fit(X_train, y_train)
+        del X_train, y_train
+
+    # Оценка — блоками по тестовой части набора
+    with stage("оценка"):
+        y_test = np.array(ds["y"][split_idx:])
+        y_proba = np.concatenate([
+            calibrated_model.predict_proba(ds["X"][i:j])[:, 1] for i, j in row_blocks(split_idx, total)
+        ])
+        y_pred = (y_proba > 0.5).astype(np.int8)
     acc = accuracy_score(y_test, y_pred)
     brier = brier_score_loss(y_test, y_proba)
     logger.info(f"\n✅ Точность: {acc:.2%} | Brier score: {brier:.4f}")
@@ -89,15 +232,233 @@ def main():
     )
 
     # Сохранение
-    joblib.dump(calibrated_model, "model_all.pkl")
-    logger.info("💾 Сохранено: model_all.pkl (RandomForest + balanced + isotonic)")
+    dump_atomic({"model": calibrated_model, "features": spec}, MODEL_PATH)
+    logger.info(f"💾 Сохранено: {MODEL_PATH} (RandomForest + balanced + isotonic)")
+
+    # Набор (уже на диске) и базовый лес — отправная точка для `train.py incremental`
+    dump_atomic({"forest": base_model, "trained_upto": split_idx, **_dataset_id(ds, meta)}, STATE_PATH)
+    logger.info(f"💾 Сохранено: {DATA_PATH}/, {STATE_PATH}")
+
+    # Прогнозы новой модели — сразу в общую БД, реплики бота отвечают без расчёта
+    with stage("прогнозы"):
+        logger.info(f"🔮 Готовых прогнозов: {precompute_predictions(currencies)}")
 
     # Важность признаков (на основе базовой модели)
-    feat_names = ["delta_prev", "delta_ma", "volatility", "RSI"]
+    feat_names = feature_names(spec)
     importances = base_model.feature_importances_
     for name, imp in zip(feat_names, importances):
         logger.info(f"   {name}: {imp:.3f}")
 
+    logger.info("Стадии (время, пиковый RSS):")
+    log_stages()
+
+
+def _dataset_id(ds: dict, meta: dict) -> dict:
+    """Чем STATE_PATH привязан к train_data/: trained_upto — номер строки именно этого набора."""
+    return {"spec": meta["spec"], "data_rows": meta["rows"], "data_fingerprint": prefix_fingerprint(ds, meta["rows"])}
+
+
+def _state_mismatch(state: dict, ds: dict, meta: dict) -> str | None:
+    """Почему лес из STATE_PATH нельзя дообучать на текущем train_data/ (None — можно)."""
+    if "data_fingerprint" not in state:
+        return "в состоянии нет описания набора (сохранено до проверки)"
+    if state["spec"] != meta["spec"]:
+        return (f"лес обучен на признаках {', '.join(feature_names(state['spec']))}, "
+                f"набор — {', '.join(feature_names(meta['spec']))}")
+    rows = state["data_rows"]
+    if meta["rows"] < rows or prefix_fingerprint(ds, rows) != state["data_fingerprint"]:
+        return "набор пересобран после обучения леса"
+    return None
+
+
+def _append_new_rows(meta: dict) -> int:
+    """Дописывает в набор строки, появившиеся после последней даты каждой валюты."""
+    today = datetime.now().toordinal()
+    spec, last_day = meta["spec"], meta["last_day"]
+    # Новые валюты входят только со свежих дней — набор остаётся упорядоченным по дате
+    newest = max(last_day.values(), default=today - DAYS_BACK)
+
+    blocks = []
+    for curr in get_all_currencies():
+        after = last_day.get(curr, newest)
+        # Нужна ещё история под прогрев признаков до первой новой строки
+        days_back = today - after + history_days(spec, FEATURE_WINDOW)
+        X, y, days = labeled_rows(collect_data_for_currency(curr, days_back), after, spec)
+        if len(X):
+            blocks.append((X.astype(np.float32), y, days, np.full(len(X), curr, dtype="U3")))
+
+    with DatasetWriter(DATA_PATH, spec, append=True) as writer:
+        return _write_block(writer, blocks)
+
+
+def _grow_forest(forest: RandomForestClassifier, X, y, seed: int) -> RandomForestClassifier:
+    """Добавляет TREES_PER_GROWTH деревьев, обученных на X, y; старейшие сверх MAX_TREES удаляются."""
+    weights = compute_class_weight("balanced", classes=np.unique(y), y=y)
+    sample_weight = weights[np.searchsorted(np.unique(y), y)]
+    forest.set_params(
+        warm_start=True,
+        class_weight=None,  # веса классов — через sample_weight, иначе warm_start ругается
+        random_state=seed,  # иначе новые деревья повторяли бы бутстрэп прошлого роста
+        n_estimators=len(forest.estimators_) + TREES_PER_GROWTH,
+    )
+    forest.fit(X, y, sample_weight=sample_weight)
+    if len(forest.estimators_) > MAX_TREES:
+        forest.estimators_ = forest.estimators_[-MAX_TREES:]
+        forest.set_params(n_estimators=MAX_TREES)
+    return forest
+
+
+def incremental():
+    """Ежедневное дообучение: стоимость зависит от числа новых строк, а не от всей истории.
+
+    1. Дописывает новые размеченные строки в набор train_data/.
+    2. Если новых строк (ещё не виденных деревьями) ≥ GROW_MIN_ROWS — доращивает лес
+       на скользящем окне ROLLING_ROWS, отбрасывая старейшие деревья.
+    3. Перекалибровывает только isotonic-слой на последних CALIB_ROWS строках,
+       не виденных лесом (если таких строк меньше CALIB_MIN_ROWS — модель не меняется).
+       Нет ни новых строк, ни новых деревьев — файлы не перезаписываются.
+    """
+    ds, meta = open_dataset(DATA_PATH)
+    if ds is None:
+        logger.error(f"❌ Нет {DATA_PATH}/ — сначала полное обучение: python train.py")
+        return
+    spec = meta["spec"]
+    state = joblib.load(STATE_PATH) if os.path.exists(STATE_PATH) else None
+    # До дозаписи: отпечаток сравнивается с набором, каким его видел лес
+    reason = state and _state_mismatch(state, ds, meta)
+    if reason:
+        logger.error(f"❌ {STATE_PATH} не соответствует {DATA_PATH}/: {reason}. "
+                     f"Нужно полное обучение: python train.py --features …")
+        return
+
+    with stage("новые строки"):
+        n_new = _append_new_rows(meta)
+    ds, meta = open_dataset(DATA_PATH)
+    total = meta["rows"]
+    logger.info(f"📥 Новых строк: {n_new} (всего {total})")
+    if total < CALIB_ROWS + GROW_MIN_ROWS:
+        logger.error("❌ Недостаточно данных для инкрементального режима.")
+        return
+
+    # memmap: ниже читаются только ограниченные срезы (новые строки, окно роста, калибровка)
+    X_all, y_all = ds["X"], ds["y"]
+    calib_from = total - CALIB_ROWS
+
+    changed = state is None
+    if state is None:
+        logger.info("Нет сохранённого леса — обучаю с нуля на всём, кроме окна калибровки...")
+        with stage("обучение"):
+            state = {"forest": make_forest().fit(*load_rows(ds, 0, calib_from, TRAIN_ROWS)),
+                     "trained_upto": calib_from}
+
+    forest = state["forest"]
+    if n_new:
+        # Честная оценка текущей модели на ещё не виденных строках
+        X_eval, y_eval = X_all[-n_new:], y_all[-n_new:]
+        proba = forest.predict_proba(X_eval)[:, 1]
+        logger.info(
+            f"📈 На новых строках: точность {accuracy_score(y_eval, proba > 0.5):.2%}, "
+            f"Brier {brier_score_loss(y_eval, proba):.4f} (до калибровки)"
+        )
+
+    pending = calib_from - state["trained_upto"]
+    if pending >= GROW_MIN_ROWS:
+        lo = max(0, calib_from - ROLLING_ROWS)
+        logger.info(f"🌲 +{TREES_PER_GROWTH} деревьев на строках {lo}…{calib_from} ({pending} новых)")
+        with stage("рост леса"):
+            forest = _grow_forest(forest, X_all[lo:calib_from], y_all[lo:calib_from], seed=total)
+        state["trained_upto"] = calib_from
+        changed = True
+    else:
+        logger.info(f"🌲 Лес без изменений ({pending} < {GROW_MIN_ROWS} новых строк)")
+
+    # Ни строк, ни деревьев: перезапись дала бы ту же модель, но новое mtime (версию) —
+    # реплики перезагрузили бы её, а кэш прогнозов в общей БД устарел бы целиком
+    if not n_new and not changed:
+        logger.info(f"Новых строк нет — {MODEL_PATH} без изменений")
+        return
+
+    # Калибровка — только на строках, которых лес не видел: иначе isotonic переуверен.
+    # Лес может быть обучен дальше calib_from (полное обучение — на 80% набора)
+    calib_from = max(calib_from, state["trained_upto"])
+    if total - calib_from < CALIB_MIN_ROWS:
+        logger.warning(
+            f"⚠️ Калибровка не обновлена: после строк, на которых обучен лес ({state['trained_upto']}), "
+            f"только {total - calib_from} < {CALIB_MIN_ROWS} строк; {MODEL_PATH} без изменений"
+        )
+        return
+
+    logger.info(f"🎯 Перекалибровка isotonic на строках {calib_from}…{total}...")
+    with stage("калибровка"):
+        calibrated_model = CalibratedClassifierCV(FrozenEstimator(forest), method="isotonic")
+        calibrated_model.fit(X_all[calib_from:], y_all[calib_from:])
+
+    state.update(forest=forest, **_dataset_id(ds, meta))
+    dump_atomic(state, STATE_PATH)
+    dump_atomic({"model": calibrated_model, "features": spec}, MODEL_PATH)
+    logger.info(f"💾 Сохранено: {MODEL_PATH} ({len(forest.estimators_)} деревьев), {DATA_PATH}/, {STATE_PATH}")
+
+    with stage("прогнозы"):
+        logger.info(f"🔮 Готовых прогнозов: {precompute_predictions(list(get_all_currencies()))}")
+
+
+def search(
+    n_iter: int | None, n_folds: int, jobs: int | None, refresh_data: bool = False,
+    spec: list[dict] | None = None, days_back: int = DAYS_BACK,
+):
+    """Поиск гиперпараметров на одном закэшированном наборе признаков (search_data/).
+
+    Набор поиска свой: пересборка не меняет train_data/, от которого отсчитывает
+    STATE_PATH дообучение. spec=None — признаки существующего набора; заданная
+    спецификация, отличная от набора, пересобирает его.
+    """
+    from search import run_search
+
+    meta = read_meta(SEARCH_DATA_PATH)
+    if meta is not None and spec is not None and meta["spec"] != spec:
+        logger.warning(
+            f"⚠️ {SEARCH_DATA_PATH}/ собран с признаками {', '.join(feature_names(meta['spec']))} — "
+            f"пересобираю под {', '.join(feature_names(spec))}"
+        )
+        refresh_data = True
+    if refresh_data or meta is None:
+        spec = spec or DEFAULT_SPEC
+        currencies = list(get_all_currencies().keys())
+        logger.info(f"Сбор набора признаков для {len(currencies)} валют за {days_back} дней...")
+        build_dataset(currencies, days_back, spec, path=SEARCH_DATA_PATH)
+    run_search(SEARCH_DATA_PATH, n_iter=n_iter, n_folds=n_folds, jobs=jobs)
+
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Обучение единой модели для всех валют")
+    parser.add_argument(
+        "mode", nargs="?", default="full", choices=["full", "incremental", "search"],
+        help="full — полное переобучение; incremental — ежедневное дообучение; "
+        "search — подбор гиперпараметров",
+    )
+    parser.add_argument("--iter", type=int, default=30, help="search: число случайных конфигураций")
+    parser.add_argument("--grid", action="store_true", help="search: полная сетка вместо случайных")
+    parser.add_argument("--folds", type=int, default=4, help="search: фолдов по времени")
+    parser.add_argument("--jobs", type=int, default=None, help="search: процессов (по умолчанию — все ядра)")
+    parser.add_argument("--refresh-data", action="store_true", help="search: пересобрать search_data/")
+    parser.add_argument(
+        "--features", help="JSON-спецификация признаков (full/search); incremental берёт её из train_data/"
+    )
+    parser.add_argument(
+        "--days-back", type=int, default=DAYS_BACK,
+        help="full/search: глубина истории в днях (вся история ЦБ — ≈12500)",
+    )
+    parser.add_argument("--chunk-days", type=int, default=CHUNK_DAYS, help="full: дней в чанке сборки признаков")
+    parser.add_argument(
+        "--profile", action="store_true", help="cProfile + tracemalloc каждой стадии в PROFILE_DIR (profiles/)"
+    )
+    args = parser.parse_args()
+    if args.profile:
+        profiling.PROFILE_ALWAYS = True
+    if args.mode == "incremental":
+        incremental()
+    elif args.mode == "search":
+        spec = load_spec(args.features) if args.features else None
+        search(None if args.grid else args.iter, args.folds, args.jobs, args.refresh_data, spec, args.days_back)
+    else:
+        main(load_spec(args.features), args.days_back, args.chunk_days)